@@ -1,28 +1,41 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, g, Response
 from flask_cors import CORS
 import cv2
 import numpy as np
-from PIL import Image
-import kociemba
-import pickle
+import solution_cache
+from solver_pool import get_solver_pool, QueueFull
+from kociemba_tables import warm_up
+from session_store import get_session_store, new_token
+from cube_validator import FACE_NAMES, split_faces, validate_or_correct
+import metrics
 import base64
-import io
-import os
-from image_processing import detect_grid, classifiy_grid
+import json
+from image_processing import (detect_grid, classifiy_grid, load_color_model, sticker_probabilities, DETECT_WIDTH,
+                              FaceStabilizer)
 
 app = Flask(__name__)
-CORS(app)
+
+# Clients identify their session by this header, a cookie, or a 'session' field
+SESSION_HEADER = 'X-Session-Token'
+SESSION_COOKIE = 'cube_session'
+# detection results travel in this header when the annotated JPEG is the body
+RESULT_HEADER = 'X-Cube-Result'
+CORS(app, expose_headers=[SESSION_HEADER, RESULT_HEADER])
 
 # Load the trained model
 def load_model():
     try:
-        loaded_model = pickle.load(open("model.sav", 'rb'))
-        return loaded_model
+        return load_color_model()
     except Exception as e:
-        print(f"Model file 'model.sav' not found! Error: {str(e)}")
+        print(f"Model file 'model.npz' not found! Error: {str(e)}")
         return None
 
 class RubiksCubeSolver:
+    # attributes kept in the session store between requests
+    STATE_FIELDS = ('green_str', 'white_str', 'red_str', 'orange_str', 'blue_str', 'yellow_str',
+                    'green_side', 'white_side', 'red_side', 'orange_side', 'blue_side', 'yellow_side',
+                    'solution', 'solve_status', 'job_id', 'colors')
+    
     def __init__(self):
         self.model = load_model()
         # Initialize with default values
@@ -46,9 +59,20 @@ class RubiksCubeSolver:
         
         self.solve_status = False
         self.scanned_faces = set()
+        self.job_id = None
+        # per-face (9, 3) BGR sticker colours, classified again only to correct misreads
+        self.colors = {}
+        # votes over consecutive frames for clients streaming a live camera
+        self.stabilizer = FaceStabilizer()
+        # to_dict() as loaded from the session store; None for a new session
+        self.stored_state = None
     
-    def scan_face(self, face_name, face_data, side_data):
+    def scan_face(self, face_name, face_data, side_data, colors=None):
         """Scan a face and update the corresponding string and side data"""
+        if colors is None:
+            self.colors.pop(face_name, None)
+        else:
+            self.colors[face_name] = [[int(c) for c in sticker] for sticker in colors]
         if face_name == "Green":
             self.green_str = face_data
             self.green_side = side_data
@@ -74,17 +98,44 @@ class RubiksCubeSolver:
             self.yellow_side = side_data
             self.scanned_faces.add("Yellow")
     
-    def solve_cube(self):
-        """Solve the cube using Kociemba algorithm"""
-        try:
-            # Create cube string in the same order as backend
-            cube_string = self.white_str + self.red_str + self.green_str + self.yellow_str + self.orange_str + self.blue_str
-            self.solution = kociemba.solve(cube_string).split(" ")
+    def cube_string(self):
+        """Create cube string in the URFDLB order the solver expects"""
+        return self.white_str + self.red_str + self.green_str + self.yellow_str + self.orange_str + self.blue_str
+    
+    def scan_probabilities(self):
+        """(54, 6) sticker colour probabilities of the scanned faces, or None without every face's colours"""
+        if not all(face in self.colors for face in FACE_NAMES):
+            return None
+        # several times the cost of a LUT lookup, so only computed for a state that fails validation
+        return sticker_probabilities([self.colors[face] for face in FACE_NAMES]).reshape(54, -1)
+    
+    def check_scan(self):
+        """(problems, changes) of the scanned state, after fixing the misread stickers it can"""
+        cube_string, problems, changes = validate_or_correct(self.cube_string(), self.scan_probabilities)
+        if changes is not None:
+            for face, face_string, side in split_faces(cube_string):
+                self.scan_face(face, face_string, side, self.colors[face])
+        return problems, changes
+    
+    def submit_solve(self, pool):
+        """Queue the solve on the worker pool instead of blocking the request"""
+        self.solve_status = False
+        self.solution = []
+        self.job_id = pool.submit(self.cube_string())
+        return self.poll_solve(pool)
+    
+    def poll_solve(self, pool):
+        """Get the queued solve's status, taking the solution once it is done"""
+        job = pool.status(self.job_id) if self.job_id else None
+        if job is None and self.job_id and not self.solve_status:
+            # the job ran in another worker process; a shared CUBE_SOLUTION_DB has its result
+            solution = solution_cache.default_cache.get(self.cube_string())
+            if solution is not None:
+                job = {'job_id': self.job_id, 'state': 'done', 'solution': solution}
+        if job is not None and job['state'] == 'done' and not self.solve_status:
+            self.solution = job['solution'].split(" ")
             self.solve_status = True
-            return True
-        except Exception as e:
-            print(f"Error solving cube: {str(e)}")
-            return False
+        return job
     
     def get_solution_steps(self):
         """Get the solution steps as a formatted string"""
@@ -102,7 +153,10 @@ class RubiksCubeSolver:
         self.grid = []
         self.face = []
         self.solution = []
+        self.job_id = None
+        self.colors = {}
         self.scanned_faces.clear()
+        self.stabilizer.reset()
         self.green_str = "FFFFFFFFF"
         self.white_str = "UUUUUUUUU"
         self.red_str = "RRRRRRRRR"
@@ -119,79 +173,320 @@ class RubiksCubeSolver:
     def all_faces_scanned(self):
         """Check if all 6 faces have been scanned"""
         return len(self.scanned_faces) == 6
+    
+    def to_dict(self):
+        """Session state as JSON-friendly values"""
+        state = {name: getattr(self, name) for name in self.STATE_FIELDS}
+        for name in state:
+            if name.endswith('_side'):
+                state[name] = [int(v) for v in state[name]]
+        state['scanned_faces'] = sorted(self.scanned_faces)
+        state['stabilizer'] = self.stabilizer.to_dict()
+        return state
+    
+    @classmethod
+    def from_dict(cls, state):
+        solver = cls()
+        for name in cls.STATE_FIELDS:
+            # sessions saved before a field was added keep its default
+            if name in state:
+                setattr(solver, name, state[name])
+        solver.scanned_faces = set(state['scanned_faces'])
+        solver.stabilizer = FaceStabilizer.from_dict(state['stabilizer'])
+        return solver
 
-# Global solver instance
-solver = RubiksCubeSolver()
+def load_session(token):
+    """(token, solver) for a session token; unknown or expired tokens get a new session"""
+    state = get_session_store().get(token) if token else None
+    if state is None:
+        return new_token(), RubiksCubeSolver()
+    solver = RubiksCubeSolver.from_dict(state)
+    solver.stored_state = solver.to_dict()
+    return token, solver
 
-@app.route('/api/process-image', methods=['POST'])
-def process_image():
-    """Process uploaded image and detect cube face"""
-    try:
-        data = request.get_json()
-        image_data = data.get('image')
-        
-        # Remove data URL prefix
-        if image_data.startswith('data:image'):
-            image_data = image_data.split(',')[1]
-        
-        # Decode base64 image
-        image_bytes = base64.b64decode(image_data)
-        image = Image.open(io.BytesIO(image_bytes))
-        image_array = np.array(image)
-        image_cv = cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR)
-        
-        # Process the image using backend functions
-        processed_image, grid = detect_grid(image_cv)
-        
-        # Convert processed image back to base64 for frontend
-        _, buffer = cv2.imencode('.jpg', processed_image)
-        processed_image_b64 = base64.b64encode(buffer).decode('utf-8')
+def save_session_state(token, solver):
+    """Write back the fields this request changed, over the session's latest stored state
+    
+    Requests that changed nothing write nothing, and a request overlapping
+    another in the same session (a streamed frame during /api/save-face)
+    cannot put back the other's fields as they were when it loaded them.
+    """
+    state = solver.to_dict()
+    if solver.stored_state is None:
+        changed = state
+    else:
+        changed = {name: value for name, value in state.items() if solver.stored_state.get(name) != value}
+        if not changed:
+            return
+    store = get_session_store()
+    current = store.get(token) if solver.stored_state is not None else None
+    store.put(token, dict(current or state, **changed))
+    solver.stored_state = state
+
+def current_solver():
+    """Solver state for the caller's session"""
+    if 'solver' not in g:
+        data = request.get_json(silent=True)
+        token = (request.headers.get(SESSION_HEADER) or request.cookies.get(SESSION_COOKIE)
+                 or (data.get('session') if isinstance(data, dict) else None) or request.form.get('session')
+                 or request.args.get('session'))
+        g.session_token, g.solver = load_session(token)
+    return g.solver
+
+@app.after_request
+def save_session(response):
+    """Write back any session changes and hand its token to the client"""
+    if 'solver' in g:
+        save_session_state(g.session_token, g.solver)
+        response.headers[SESSION_HEADER] = g.session_token
+        response.set_cookie(SESSION_COOKIE, g.session_token, httponly=True, samesite='Lax')
+    return response
+
+def is_true(value):
+    """Flag from JSON (true) or a form/query string ('1', 'true')"""
+    return value in (True, 1, '1', 'true')
+
+def data_url_bytes(image_data):
+    """Image bytes from a base64 string, with or without a data URL prefix"""
+    if image_data.startswith('data:image'):
+        image_data = image_data.split(',')[1]
+    with metrics.timer("base64_decode"):
+        return base64.b64decode(image_data)
+
+def decode_image(buffer):
+    """BGR image straight from encoded bytes, without an intermediate PIL image"""
+    with metrics.timer("decode"):
+        image = cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode image")
+    return image
+
+def read_upload():
+    """Encoded image bytes and request fields from a multipart file, a raw image body or base64 JSON"""
+    if request.files:
+        upload = request.files.get('image') or next(iter(request.files.values()))
+        return upload.read(), request.form
+    if request.mimetype.startswith('image/') or request.mimetype == 'application/octet-stream':
+        return request.get_data(cache=False), request.args
+    fields = request.get_json()
+    return data_url_bytes(fields.get('image')), fields
+
+def analyse_face(solver, image_cv, stream=False):
+    """Detect and classify the face in a BGR frame; returns the annotated frame and response fields"""
+    processed_image, grid = detect_grid(image_cv, detect_width=DETECT_WIDTH)
+    
+    response = {
+        'success': True,
+        'grid_detected': len(grid) == 9,
+        'grid_count': len(grid)
+    }
+    
+    if len(grid) == 9:
+        # Classify the grid using backend function
+        face_string, predictions = classifiy_grid(grid)
         
-        response = {
-            'success': True,
-            'processed_image': f'data:image/jpeg;base64,{processed_image_b64}',
-            'grid_detected': len(grid) == 9,
-            'grid_count': len(grid)
-        }
+        # Streaming clients only get a face once consecutive frames agree
+        if stream:
+            solver.stabilizer.push(predictions)
+            response['confidence'] = solver.stabilizer.confidence()
+            stable = solver.stabilizer.vote()
+            if stable is None:
+                response['message'] = "Hold the cube steady"
+                response['status'] = 'stabilizing'
+                return processed_image, response
+            face_string, predictions, response['confidence'] = stable
         
-        if len(grid) == 9:
-            # Classify the grid using backend function
-            face_string, predictions = classifiy_grid(grid)
+        if face_string:
+            # Determine which face this is based on center color
+            center_color = predictions[4] if len(predictions) > 4 else None
+            face_mapping = {
+                0: "Green",
+                1: "White", 
+                2: "Red",
+                3: "Orange",
+                4: "Blue",
+                5: "Yellow"
+            }
+            
+            detected_face = face_mapping.get(center_color, "Unknown")
             
-            if face_string:
-                # Determine which face this is based on center color
-                center_color = predictions[4] if len(predictions) > 4 else None
-                face_mapping = {
-                    0: "Green",
-                    1: "White", 
-                    2: "Red",
-                    3: "Orange",
-                    4: "Blue",
-                    5: "Yellow"
-                }
-                
-                detected_face = face_mapping.get(center_color, "Unknown")
-                
-                if detected_face != "Unknown":
-                    if detected_face in solver.scanned_faces:
-                        response['message'] = f"{detected_face} already scanned"
-                        response['status'] = 'already_scanned'
-                    else:
-                        response['detected_face'] = detected_face
-                        response['face_string'] = face_string
-                        response['predictions'] = predictions.tolist()
-                        response['status'] = 'new_face'
+            if detected_face != "Unknown":
+                if detected_face in solver.scanned_faces:
+                    response['message'] = f"{detected_face} already scanned"
+                    response['status'] = 'already_scanned'
                 else:
-                    response['message'] = "Could not detect face type"
-                    response['status'] = 'unknown_face'
+                    response['detected_face'] = detected_face
+                    response['face_string'] = face_string
+                    response['predictions'] = predictions.tolist()
+                    response['colors'] = grid[:, :3].tolist()
+                    response['status'] = 'new_face'
             else:
-                response['message'] = "Could not classify grid"
-                response['status'] = 'classification_failed'
+                response['message'] = "Could not detect face type"
+                response['status'] = 'unknown_face'
         else:
-            response['message'] = f"Grid not detected. Found {len(grid)} squares."
-            response['status'] = 'no_grid'
-        
-        return jsonify(response)
+            response['message'] = "Could not classify grid"
+            response['status'] = 'classification_failed'
+    else:
+        response['message'] = f"Grid not detected. Found {len(grid)} squares."
+        response['status'] = 'no_grid'
+    
+    return processed_image, response
+
+def analyse_upload(solver, buffer, stream=False, output=None):
+    """Decode, analyse and re-encode one upload; all the CPU work of /api/process-image
+    
+    Returns the response fields and the annotated JPEG bytes (None when
+    output is 'json').  Unless output is 'jpeg' the JPEG is also embedded in
+    the fields as a base64 data URL.
+    """
+    processed_image, response = analyse_face(solver, decode_image(buffer), stream=stream)
+    if output == 'json':
+        return response, None
+    with metrics.timer("encode"):
+        _, buffer = cv2.imencode('.jpg', processed_image)
+    if output != 'jpeg':
+        # Convert processed image back to base64 for frontend
+        with metrics.timer("base64_encode"):
+            processed_image_b64 = base64.b64encode(buffer).decode('utf-8')
+        response['processed_image'] = f'data:image/jpeg;base64,{processed_image_b64}'
+    return response, buffer.tobytes()
+
+def save_face_result(solver, data):
+    """Response body and status code for /api/save-face"""
+    face_name = data.get('face_name')
+    face_string = data.get('face_string')
+    predictions = data.get('predictions')
+    
+    solver.scan_face(face_name, face_string, predictions, data.get('colors'))
+    
+    # Auto-solve when all faces are scanned; poll /api/get-solution for the result
+    job = None
+    # one or two misread stickers are fixed from the sticker colours sent with each face
+    problems, corrected = solver.check_scan() if solver.all_faces_scanned() else ([], None)
+    if problems:
+        # a misread sticker; say which so the face can be rescanned instead of queueing a doomed solve
+        solver.solve_status = False
+        solver.solution = []
+        solver.job_id = None
+    elif solver.all_faces_scanned():
+        try:
+            job = solver.submit_solve(get_solver_pool())
+        except QueueFull as e:
+            return {'success': False, 'error': f"Solver busy, try again shortly ({str(e)})"}, 503
+    
+    response = {
+        'success': True,
+        'scanned_faces': list(solver.scanned_faces),
+        'progress': len(solver.scanned_faces) / 6,
+        'all_faces_scanned': solver.all_faces_scanned(),
+        'solution_ready': solver.solve_status
+    }
+    if corrected:
+        response['corrected'] = corrected
+        response['message'] = f"Corrected {len(corrected)} misread sticker(s)"
+    if problems:
+        response['solve_state'] = 'invalid'
+        response['message'] = f"Cube state is inconsistent: {problems[0].message}"
+        response['problems'] = [problem.to_dict() for problem in problems]
+    if job is not None:
+        response['job_id'] = job['job_id']
+        response['solve_state'] = job['state']
+    return response, 200
+
+def solution_result(solver, job_id=None):
+    """Response body and status code for /api/get-solution"""
+    if job_id and job_id != solver.job_id:
+        job = get_solver_pool().status(job_id)
+        if job is None:
+            return {'success': False, 'message': 'Unknown job id'}, 404
+        if job['state'] == 'done':
+            job['moves'] = job['solution'].split(" ")
+            job['move_count'] = len(job['moves'])
+        return dict(job, success=job['state'] == 'done'), 200
+    
+    job = solver.poll_solve(get_solver_pool()) if solver.job_id else None
+    if solver.solve_status:
+        solution_steps = solver.get_solution_steps()
+        return {
+            'success': True,
+            'solution': solution_steps,
+            'moves': solver.solution,
+            'move_count': len(solver.solution) if solver.solution else 0
+        }, 200
+    elif job is not None:
+        return {
+            'success': False,
+            'job_id': job['job_id'],
+            'state': job['state'],
+            'message': job.get('error', 'Solution not ready yet')
+        }, 200
+    else:
+        return {
+            'success': False,
+            'message': 'No solution available. Please scan all faces first.'
+        }, 200
+
+def cancel_result(solver, job_id=None):
+    """Response body and status code for /api/cancel-solve"""
+    job_id = job_id or solver.job_id
+    cancelled = bool(job_id) and get_solver_pool().cancel(job_id)
+    return {'success': cancelled, 'job_id': job_id}, 200
+
+def reset_result(solver):
+    """Response body and status code for /api/reset"""
+    if solver.job_id:
+        get_solver_pool().cancel(solver.job_id)
+    solver.reset_cube()
+    return {
+        'success': True,
+        'message': 'Cube state reset successfully'
+    }, 200
+
+def status_result(solver):
+    """Response body and status code for /api/status"""
+    return {
+        'success': True,
+        'scanned_faces': list(solver.scanned_faces),
+        'progress': len(solver.scanned_faces) / 6,
+        'all_faces_scanned': solver.all_faces_scanned(),
+        'solution_ready': solver.solve_status,
+        'cube_state': {
+            'green_side': solver.green_side,
+            'white_side': solver.white_side,
+            'red_side': solver.red_side,
+            'orange_side': solver.orange_side,
+            'blue_side': solver.blue_side,
+            'yellow_side': solver.yellow_side
+        }
+    }, 200
+
+ENDPOINTS = [
+    '/api/process-image',
+    '/api/save-face', 
+    '/api/get-solution',
+    '/api/cancel-solve',
+    '/api/reset',
+    '/api/status',
+    '/metrics'
+]
+
+@app.route('/api/process-image', methods=['POST'])
+def process_image():
+    """Process uploaded image and detect cube face
+    
+    Accepts base64 JSON, a multipart 'image' file or a raw image body.
+    ?format=json returns only the detection, ?format=jpeg the annotated
+    JPEG with the detection in the X-Cube-Result header.
+    """
+    try:
+        with metrics.timer("process_image"):
+            solver = current_solver()
+            buffer, fields = read_upload()
+            output = request.args.get('format')
+            response, jpeg = analyse_upload(solver, buffer, stream=is_true(fields.get('stream')), output=output)
+            if output == 'jpeg':
+                return Response(jpeg, mimetype='image/jpeg', headers={RESULT_HEADER: json.dumps(response)})
+            return jsonify(response)
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -200,24 +495,8 @@ def process_image():
 def save_face():
     """Save a detected face to the solver"""
     try:
-        data = request.get_json()
-        face_name = data.get('face_name')
-        face_string = data.get('face_string')
-        predictions = data.get('predictions')
-        
-        solver.scan_face(face_name, face_string, predictions)
-        
-        # Auto-solve when all faces are scanned
-        if solver.all_faces_scanned():
-            solver.solve_cube()
-        
-        return jsonify({
-            'success': True,
-            'scanned_faces': list(solver.scanned_faces),
-            'progress': len(solver.scanned_faces) / 6,
-            'all_faces_scanned': solver.all_faces_scanned(),
-            'solution_ready': solver.solve_status
-        })
+        response, status = save_face_result(current_solver(), request.get_json())
+        return jsonify(response), status
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -226,19 +505,19 @@ def save_face():
 def get_solution():
     """Get the solution steps"""
     try:
-        if solver.solve_status:
-            solution_steps = solver.get_solution_steps()
-            return jsonify({
-                'success': True,
-                'solution': solution_steps,
-                'moves': solver.solution,
-                'move_count': len(solver.solution) if solver.solution else 0
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'message': 'No solution available. Please scan all faces first.'
-            })
+        response, status = solution_result(current_solver(), request.args.get('job_id'))
+        return jsonify(response), status
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/cancel-solve', methods=['POST'])
+def cancel_solve():
+    """Cancel a queued or running solve"""
+    try:
+        data = request.get_json(silent=True) or {}
+        response, status = cancel_result(current_solver(), data.get('job_id'))
+        return jsonify(response), status
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -247,11 +526,8 @@ def get_solution():
 def reset_cube():
     """Reset the cube state"""
     try:
-        solver.reset_cube()
-        return jsonify({
-            'success': True,
-            'message': 'Cube state reset successfully'
-        })
+        response, status = reset_result(current_solver())
+        return jsonify(response), status
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -260,38 +536,27 @@ def reset_cube():
 def get_status():
     """Get current solver status"""
     try:
-        return jsonify({
-            'success': True,
-            'scanned_faces': list(solver.scanned_faces),
-            'progress': len(solver.scanned_faces) / 6,
-            'all_faces_scanned': solver.all_faces_scanned(),
-            'solution_ready': solver.solve_status,
-            'cube_state': {
-                'green_side': solver.green_side,
-                'white_side': solver.white_side,
-                'red_side': solver.red_side,
-                'orange_side': solver.orange_side,
-                'blue_side': solver.blue_side,
-                'yellow_side': solver.yellow_side
-            }
-        })
+        response, status = status_result(current_solver())
+        return jsonify(response), status
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Per-stage latency histograms in the Prometheus text format (enable with CUBE_METRICS=1)"""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def home():
     return jsonify({
         'message': 'Rubik\'s Cube Solver API',
         'status': 'running',
-        'endpoints': [
-            '/api/process-image',
-            '/api/save-face', 
-            '/api/get-solution',
-            '/api/reset',
-            '/api/status'
-        ]
+        'endpoints': ENDPOINTS
     })
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5001) 
\ No newline at end of file
+    load_color_model()
+    warm_up()
+    get_solver_pool()
+    app.run(debug=True, host='0.0.0.0', port=5001)
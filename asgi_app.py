@@ -0,0 +1,295 @@
+"""ASGI version of the Flask API in app.py, for many concurrent (slow) clients.
+
+Request bodies are received on the event loop; decoding, detection,
+classification and JPEG encoding run in a bounded thread pool.  When that
+pool's queue is full, /api/process-image answers 429 instead of piling up
+work.  /api/load reports requests in flight and queue depths for sizing.
+/ws/frames takes a live stream of camera frames over a WebSocket.
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5001
+"""
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.datastructures import UploadFile
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+
+from app import (ENDPOINTS, RESULT_HEADER, SESSION_COOKIE, SESSION_HEADER, analyse_upload, cancel_result,
+                 data_url_bytes, is_true, load_session, reset_result, save_face_result, save_session_state,
+                 solution_result, status_result)
+import metrics
+from image_processing import load_color_model
+from kociemba_tables import warm_up
+from solver_pool import get_solver_pool
+
+
+class Busy(Exception):
+    """Raised when the executor already holds `max_queue` waiting tasks"""
+
+
+class BadRequest(Exception):
+    """A malformed request body, answered with 400"""
+
+
+class BoundedExecutor:
+    """Thread pool for CPU-bound request work that refuses work once its queue is full
+
+    Only touched from the event loop thread, so the counter needs no lock.
+    OpenCV and NumPy release the GIL, so the threads run in parallel.
+    """
+
+    def __init__(self, workers=4, max_queue=16):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="vision")
+        self.in_flight = 0
+
+    def queue_depth(self):
+        return max(self.in_flight - self.workers, 0)
+
+    async def run(self, fn, *args, **kwargs):
+        if self.in_flight >= self.workers + self.max_queue:
+            raise Busy(f"{self.queue_depth()} frames already queued")
+        self.in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, lambda: fn(*args, **kwargs))
+        finally:
+            self.in_flight -= 1
+
+
+executor = BoundedExecutor(workers=int(os.environ.get("CUBE_VISION_WORKERS", os.cpu_count() or 1)),
+                           max_queue=int(os.environ.get("CUBE_VISION_QUEUE", 16)))
+requests_in_flight = 0
+streams_open = 0
+
+
+async def request_fields(request):
+    """JSON body, form fields or query parameters, whichever the request carries"""
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("application/json"):
+        try:
+            fields = await request.json()
+        except ValueError:
+            raise BadRequest("Request body is not valid JSON")
+        if not isinstance(fields, dict):
+            raise BadRequest("Expected a JSON object")
+        return fields
+    if content_type.startswith(("multipart/form-data", "application/x-www-form-urlencoded")):
+        return await request.form()
+    return request.query_params
+
+
+def session_endpoint(handler):
+    """Run `handler(request, solver, fields)` inside the caller's session, like app.current_solver"""
+    async def endpoint(request):
+        global requests_in_flight
+        requests_in_flight += 1
+        token = request.headers.get(SESSION_HEADER) or request.cookies.get(SESSION_COOKIE)
+        try:
+            fields = await request_fields(request)
+            token, solver = load_session(token or fields.get("session") or request.query_params.get("session"))
+            try:
+                response = await handler(request, solver, fields)
+            finally:
+                save_session_state(token, solver)
+            response.headers[SESSION_HEADER] = token
+            response.set_cookie(SESSION_COOKIE, token, httponly=True, samesite="lax")
+            return response
+        except Busy as e:
+            return JSONResponse({"success": False, "error": f"Server busy, try again shortly ({str(e)})"},
+                                status_code=429, headers={"Retry-After": "1"})
+        except BadRequest as e:
+            return JSONResponse({"success": False, "error": str(e)}, status_code=400)
+        except Exception as e:
+            return JSONResponse({"success": False, "error": str(e)}, status_code=500)
+        finally:
+            requests_in_flight -= 1
+    endpoint.__doc__ = handler.__doc__
+    return endpoint
+
+
+@session_endpoint
+async def process_image(request, solver, fields):
+    """Same uploads and ?format= options as the Flask endpoint"""
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        # like Flask: the `image` file, else the first file uploaded
+        upload = fields.get("image")
+        if not isinstance(upload, UploadFile):
+            upload = next((value for value in fields.values() if isinstance(value, UploadFile)), None)
+        if upload is None:
+            raise BadRequest("No image file in the upload")
+        buffer = await upload.read()
+    elif content_type.startswith("application/json"):
+        if not isinstance(fields.get("image"), str):
+            raise BadRequest("Missing base64 image")
+        buffer = data_url_bytes(fields["image"])
+    else:
+        buffer = await request.body()
+    output = request.query_params.get("format")
+    with metrics.timer("process_image"):
+        response, jpeg = await executor.run(analyse_upload, solver, buffer,
+                                            stream=is_true(fields.get("stream")), output=output)
+    if output == "jpeg":
+        return Response(jpeg, media_type="image/jpeg", headers={RESULT_HEADER: json.dumps(response)})
+    return JSONResponse(response)
+
+
+@session_endpoint
+async def save_face(request, solver, fields):
+    # validating and correcting a complete cube is CPU work, so keep it off the event loop
+    response, status = await executor.run(save_face_result, solver, fields)
+    return JSONResponse(response, status_code=status)
+
+
+@session_endpoint
+async def get_solution(request, solver, fields):
+    response, status = solution_result(solver, request.query_params.get("job_id"))
+    return JSONResponse(response, status_code=status)
+
+
+@session_endpoint
+async def cancel_solve(request, solver, fields):
+    response, status = cancel_result(solver, fields.get("job_id"))
+    return JSONResponse(response, status_code=status)
+
+
+@session_endpoint
+async def reset_cube(request, solver, fields):
+    response, status = reset_result(solver)
+    return JSONResponse(response, status_code=status)
+
+
+@session_endpoint
+async def get_status(request, solver, fields):
+    response, status = status_result(solver)
+    return JSONResponse(response, status_code=status)
+
+
+async def frame_stream(websocket):
+    """Binary JPEG/PNG frames in, one JSON detection out per processed frame
+
+    Frames that arrive while one is being processed replace each other, so a
+    client sending faster than we keep up only gets its newest frame analysed;
+    `dropped` counts the skipped ones.  Detections go through the session's
+    stabiliser like ?stream=1 REST uploads.  With ?annotate=1 each detection
+    is followed by the annotated JPEG as a binary message.  The session is
+    reloaded for every frame, so faces saved over REST meanwhile are kept.
+    """
+    global streams_open
+    await websocket.accept()
+    token, solver = load_session(websocket.query_params.get("session") or websocket.headers.get(SESSION_HEADER)
+                                 or websocket.cookies.get(SESSION_COOKIE))
+    # store a new session straight away so REST calls can join it before the first frame
+    save_session_state(token, solver)
+    output = "jpeg" if is_true(websocket.query_params.get("annotate")) else "json"
+    latest = {"frame": None, "seq": 0, "dropped": 0}
+    ready = asyncio.Event()
+
+    async def receive():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("bytes") is not None:
+                if latest["frame"] is not None:
+                    latest["dropped"] += 1
+                latest["frame"] = message["bytes"]
+                latest["seq"] += 1
+                ready.set()
+
+    streams_open += 1
+    receiver = asyncio.create_task(receive())
+    try:
+        await websocket.send_json({"type": "session", "session": token})
+        while True:
+            waiter = asyncio.create_task(ready.wait())
+            done, _ = await asyncio.wait({receiver, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver in done:
+                waiter.cancel()
+                break
+            ready.clear()
+            frame, seq = latest["frame"], latest["seq"]
+            latest["frame"] = None
+            jpeg = None
+            # keeps the token even if the session expired mid-stream
+            solver = load_session(token)[1]
+            try:
+                response, jpeg = await executor.run(analyse_upload, solver, frame, stream=True, output=output)
+            except Busy as e:
+                response = {"success": False, "status": "busy", "error": str(e)}
+            except Exception as e:
+                response = {"success": False, "error": str(e)}
+            response.update(type="detection", frame=seq, dropped=latest["dropped"])
+            await websocket.send_json(response)
+            if jpeg is not None:
+                await websocket.send_bytes(jpeg)
+            save_session_state(token, solver)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        streams_open -= 1
+
+
+async def get_load(request):
+    """Requests in flight and queue depths, for sizing instances"""
+    return JSONResponse({
+        "requests_in_flight": requests_in_flight,
+        "streams_open": streams_open,
+        "vision_in_flight": executor.in_flight,
+        "vision_queue_depth": executor.queue_depth(),
+        "vision_workers": executor.workers,
+        "vision_max_queue": executor.max_queue,
+        "solver_queue_depth": get_solver_pool().queue_depth(),
+    })
+
+
+async def get_metrics(request):
+    return Response(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+async def home(request):
+    return JSONResponse({
+        "message": "Rubik's Cube Solver API",
+        "status": "running",
+        "endpoints": ENDPOINTS + ["/api/load", "/ws/frames"],
+    })
+
+
+def startup():
+    load_color_model()
+    warm_up()
+    get_solver_pool()
+
+
+app = Starlette(
+    routes=[
+        Route("/api/process-image", process_image, methods=["POST"]),
+        Route("/api/save-face", save_face, methods=["POST"]),
+        Route("/api/get-solution", get_solution, methods=["GET"]),
+        Route("/api/cancel-solve", cancel_solve, methods=["POST"]),
+        Route("/api/reset", reset_cube, methods=["POST"]),
+        Route("/api/status", get_status, methods=["GET"]),
+        Route("/api/load", get_load, methods=["GET"]),
+        Route("/metrics", get_metrics, methods=["GET"]),
+        WebSocketRoute("/ws/frames", frame_stream),
+        Route("/", home),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"],
+                           expose_headers=[SESSION_HEADER, RESULT_HEADER])],
+    on_startup=[startup],
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=5001)
@@ -0,0 +1,183 @@
+"""Capture labelled sticker colours from a camera or video for color_train.py.
+
+Hold one colour of sticker up to the camera (e.g. a solved face) and every
+detected 9-sticker face adds nine samples, in sticker order, to a
+preallocated buffer.  Whenever the buffer fills it is written out as a
+compressed shard, so an interrupted capture keeps everything but the last
+partial shard's worth, which is written on exit when possible.
+
+    python capture_data.py --label yellow --out samples/
+    python capture_data.py --label 5 --out samples/ --source clip.mp4 --no-preview --patches
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from image_processing import DETECT_WIDTH, FACE_LETTERS, detection_scale, locate_stickers, mark_grid
+
+# label ids of image_processing's colour model
+COLOR_NAMES = ("green", "white", "red", "orange", "blue", "yellow")
+
+
+def parse_label(value):
+    """Label id from an id ("5"), a colour name ("yellow") or a face letter ("D")"""
+    if value.isdigit() and int(value) < len(COLOR_NAMES):
+        return int(value)
+    if value.lower() in COLOR_NAMES:
+        return COLOR_NAMES.index(value.lower())
+    if value.upper() in FACE_LETTERS:
+        return int(np.flatnonzero(FACE_LETTERS == value.upper())[0])
+    raise argparse.ArgumentTypeError(f"Unknown label {value!r}: use 0-5, a colour name or a face letter")
+
+
+def shard_numbers(out_dir, prefix, fmt):
+    """Numbers of the existing {prefix}-NNNNN.{fmt} shards in out_dir"""
+    numbers = []
+    for path in glob.glob(os.path.join(out_dir, f"{prefix}-*.{fmt}")):
+        number = os.path.basename(path)[len(prefix) + 1:-len(fmt) - 1]
+        if number.isdigit():
+            numbers.append(int(number))
+    return numbers
+
+
+class SampleBuffer:
+    """Preallocated sample arrays, written out as a shard each time they fill up
+
+    NPZ shards hold `colors` (N, 3) and `labels` (N,) uint8 arrays, plus
+    `patches` (N, size, size, 3) when patch_size is set; Parquet shards hold
+    b, g, r and label columns.  Shards are written to a temporary name and
+    renamed, so a crash never leaves a truncated one behind.
+    """
+
+    def __init__(self, out_dir, label, size=50000, patch_size=None, fmt="npz"):
+        if fmt == "parquet" and patch_size:
+            raise ValueError("Patches can only be saved in npz shards")
+        self.out_dir = out_dir
+        self.label = label
+        self.fmt = fmt
+        self.prefix = COLOR_NAMES[label]
+        # whole faces only, so every shard keeps faces together
+        size = max(size - size % 9, 9)
+        self.colors = np.empty((size, 3), dtype=np.uint8)
+        self.patches = np.empty((size, patch_size, patch_size, 3), dtype=np.uint8) if patch_size else None
+        self.count = 0
+        self.total = 0
+        os.makedirs(out_dir, exist_ok=True)
+        # carry on after the highest shard of earlier runs, even if some were deleted
+        self.shard = max(shard_numbers(out_dir, self.prefix, fmt), default=-1) + 1
+
+    def add(self, colors, patches=None):
+        """Append samples; returns the path of the shard written to make room, if any"""
+        path = None
+        if self.count + len(colors) > len(self.colors):
+            path = self.flush()
+        end = self.count + len(colors)
+        self.colors[self.count:end] = colors
+        if self.patches is not None:
+            self.patches[self.count:end] = patches
+        self.count = end
+        self.total += len(colors)
+        return path
+
+    def flush(self):
+        """Write the buffered samples as the next shard; returns its path, or None if empty"""
+        if self.count == 0:
+            return None
+        path = os.path.join(self.out_dir, f"{self.prefix}-{self.shard:05d}.{self.fmt}")
+        while os.path.exists(path):
+            # written meanwhile by another capture into the same directory; never replace it
+            self.shard += 1
+            path = os.path.join(self.out_dir, f"{self.prefix}-{self.shard:05d}.{self.fmt}")
+        tmp = f"{path}.tmp"
+        colors = self.colors[:self.count]
+        labels = np.full(self.count, self.label, dtype=np.uint8)
+        if self.fmt == "parquet":
+            import pandas
+            pandas.DataFrame({"b": colors[:, 0], "g": colors[:, 1], "r": colors[:, 2],
+                              "label": labels}).to_parquet(tmp, index=False)
+        else:
+            arrays = {"colors": colors, "labels": labels}
+            if self.patches is not None:
+                arrays["patches"] = self.patches[:self.count]
+            with open(tmp, "wb") as f:
+                np.savez_compressed(f, **arrays)
+        os.replace(tmp, path)
+        self.shard += 1
+        self.count = 0
+        return path
+
+
+def crop_patches(image, rects, size):
+    """Each (x, y, w, h) sticker resized to a size x size patch"""
+    patches = np.empty((len(rects), size, size, 3), dtype=np.uint8)
+    for i, (x, y, w, h) in enumerate(rects):
+        patches[i] = cv2.resize(image[max(y, 0):y + h, max(x, 0):x + w], (size, size), interpolation=cv2.INTER_AREA)
+    return patches
+
+
+def capture(source, buffer, count=None, preview=True, detect_width=DETECT_WIDTH, patch_size=None):
+    """Add every detected face from `source` to `buffer` until it ends, `count` samples or q"""
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise SystemExit(f"Could not open video source {source!r}")
+    faces = 0
+    try:
+        while count is None or buffer.total < count:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            factor, scale = detection_scale(frame.shape[1], detect_width)
+            rects = locate_stickers(frame, factor, scale)
+            if len(rects) == 9:
+                # same order as mark_grid sorts the sampled colours
+                order = (50 * rects[:, 1] + 10 * rects[:, 0]).argsort()
+                patches = crop_patches(frame, rects[order], patch_size) if patch_size else None
+                frame, grid = mark_grid(frame, rects, factor)
+                path = buffer.add(grid[:, :3], patches)
+                faces += 1
+                if path:
+                    print(f"wrote {path} ({buffer.total} samples from {faces} faces)", file=sys.stderr)
+            if preview:
+                cv2.imshow("capture", frame)
+                if cv2.waitKey(1) & 0xFF == ord("q"):
+                    break
+    finally:
+        path = buffer.flush()
+        cap.release()
+        if preview:
+            cv2.destroyAllWindows()
+        if path:
+            print(f"wrote {path}", file=sys.stderr)
+    return faces
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Capture labelled sticker colours for color_train.py.")
+    parser.add_argument("--label", required=True, type=parse_label, help="colour shown: 0-5, a name (yellow) or a face letter (D)")
+    parser.add_argument("--out", required=True, help="directory for the shards")
+    parser.add_argument("--source", default="0", help="camera index or video file/URL (default: camera 0)")
+    parser.add_argument("--count", type=int, help="stop after this many samples (default: until q or the video ends)")
+    parser.add_argument("--shard-size", type=int, default=50000, help="samples per shard (default: 50000)")
+    parser.add_argument("--format", choices=["npz", "parquet"], default="npz")
+    parser.add_argument("--patches", action="store_true", help="also save each sticker's pixels, for re-featurising later")
+    parser.add_argument("--patch-size", type=int, default=16, help="side of the saved patches in pixels (default: 16)")
+    parser.add_argument("--no-preview", action="store_true", help="do not show the camera window")
+    args = parser.parse_args(argv)
+
+    patch_size = args.patch_size if args.patches else None
+    buffer = SampleBuffer(args.out, args.label, args.shard_size, patch_size, args.format)
+    source = int(args.source) if args.source.isdigit() else args.source
+    start = time.perf_counter()
+    faces = capture(source, buffer, args.count, not args.no_preview, patch_size=patch_size)
+    elapsed = time.perf_counter() - start
+    print(f"captured {buffer.total} {COLOR_NAMES[args.label]} samples from {faces} faces in {elapsed:.1f}s",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Sticker colour features shared by color_train.py and image_processing.classifiy_grid.
+
+The colour model stores its feature settings next to its weights, so the
+same transform is applied when training and when classifying:
+
+- space: "bgr" (raw channel means, what the original model uses), "hsv"
+  (hue as cos/sin so red wraps round, saturation, value) or "lab"
+- degree: 2 adds pairwise products, giving the linear model curved class
+  boundaries for a few more multiply-adds
+- white_balance: rescale each face's channels so its centre sticker reads
+  as that colour's reference, cancelling the tint of the light
+"""
+import cv2
+import numpy as np
+
+SPACES = ("bgr", "hsv", "lab")
+# L in 0-100 and a, b in about +-127, brought to similar scales
+_LAB_SCALE = np.array([1 / 100, 1 / 127, 1 / 127], dtype=np.float32)
+STATS = ("mean", "median", "trimmed")
+
+
+class ColorFeatures:
+    def __init__(self, space="bgr", degree=1, white_balance=False):
+        if space not in SPACES:
+            raise ValueError(f"Unknown colour space {space!r}, expected one of {SPACES}")
+        if degree not in (1, 2):
+            raise ValueError(f"degree must be 1 or 2, got {degree}")
+        self.space = space
+        self.degree = degree
+        self.white_balance = white_balance
+        self.identity = space == "bgr" and degree == 1
+        n_base = 4 if space == "hsv" else 3
+        self.pairs = np.triu_indices(n_base)
+
+    @classmethod
+    def from_npz(cls, weights):
+        """Settings saved by to_npz(); a model file without them uses raw BGR"""
+        if "feature_space" not in weights:
+            return cls()
+        return cls(str(weights["feature_space"]), int(weights["feature_degree"]), bool(weights["white_balance"]))
+
+    def to_npz(self):
+        return {"feature_space": self.space, "feature_degree": self.degree, "white_balance": self.white_balance}
+
+    def transform(self, bgr):
+        """(N, 3) BGR channel means in 0-255 -> (N, k) feature rows"""
+        if self.identity:
+            return bgr
+        bgr = np.array(bgr, dtype=np.float32).reshape(-1, 1, 3)
+        bgr *= 1 / 255
+        if self.space == "hsv":
+            hsv = cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV).reshape(-1, 3)
+            hue = np.radians(hsv[:, 0])
+            base = np.column_stack((np.cos(hue) * hsv[:, 1], np.sin(hue) * hsv[:, 1], hsv[:, 1], hsv[:, 2]))
+        elif self.space == "lab":
+            base = cv2.cvtColor(bgr, cv2.COLOR_BGR2Lab).reshape(-1, 3)
+            base *= _LAB_SCALE
+        else:
+            base = bgr.reshape(-1, 3)
+        if self.degree == 2:
+            i, j = self.pairs
+            base = np.concatenate((base, base[:, i] * base[:, j]), axis=1)
+        return base
+
+    def __repr__(self):
+        return f"ColorFeatures(space={self.space!r}, degree={self.degree}, white_balance={self.white_balance})"
+
+
+def white_balance(faces, centres, softening=64.0):
+    """Rescale each face's channels so its centre sticker reads as `centres`
+
+    `faces` is (9, 3) or (N, 9, 3) BGR in sticker order, `centres` the
+    (3,) or (N, 3) reference colours of the centres' classes.  `softening`
+    is added to both sides of each gain: a saturated centre is dark in some
+    channels, and dividing by those alone would mostly amplify noise.
+    """
+    faces = np.asarray(faces)
+    if faces.ndim == 2:
+        # a single face, the scanning case: scalar gains save several small-array NumPy calls
+        gains = np.array([(c + softening) / (f + softening)
+                          for c, f in zip(np.asarray(centres).tolist(), faces[4].tolist())])
+    else:
+        centres = np.asarray(centres, dtype=np.float64)[..., None, :]
+        gains = (centres + softening) / (faces[..., 4:5, :] + softening)
+    # gains are positive, so only the top needs clamping (np.clip is slow on small arrays)
+    return np.minimum(faces * gains, 255)
+
+
+def class_references(bgr, labels, classes):
+    """Median BGR of each class, the white-balance target for centre stickers of that colour"""
+    bgr = np.asarray(bgr, dtype=np.float64)
+    labels = np.asarray(labels)
+    return np.array([np.median(bgr[labels == c], axis=0) for c in classes])
+
+
+def robust_color(patch, stat="median", trim=0.2):
+    """Channel median or `trim`-trimmed mean of an (h, w, 3) patch, ignoring glare and edge pixels"""
+    pixels = patch.reshape(-1, patch.shape[-1])
+    if len(pixels) == 0:
+        return np.zeros(patch.shape[-1])
+    if stat == "median":
+        return np.median(pixels, axis=0)
+    if stat == "trimmed":
+        pixels = np.sort(pixels, axis=0)
+        cut = int(len(pixels) * trim)
+        return pixels[cut:len(pixels) - cut].mean(axis=0)
+    return pixels.mean(axis=0)
@@ -1,37 +1,300 @@
-from cgi import test
-from numpy import array
-import pandas
-from sklearn import model_selection
-from sklearn.linear_model import LogisticRegression
-import pickle
-
-dataframe1 = pandas.read_excel("E:/semester_work/Digital Image Processsing/Project/green.xlsx")
-dataframe2 = pandas.read_excel("E:/semester_work/Digital Image Processsing/Project/white.xlsx")
-dataframe3 = pandas.read_excel("E:/semester_work/Digital Image Processsing/Project/red.xlsx")
-dataframe4 = pandas.read_excel("E:/semester_work/Digital Image Processsing/Project/orange.xlsx")
-dataframe5 = pandas.read_excel("E:/semester_work/Digital Image Processsing/Project/blue.xlsx")
-dataframe6 = pandas.read_excel("E:/semester_work/Digital Image Processsing/Project/yellow.xlsx")
-frames = [dataframe1,dataframe2,dataframe3,dataframe4,dataframe5,dataframe6]
-
-result = pandas.concat(frames).sample(frac=1)
-array = result.values
-
-X = array[:,0:3]
-Y = array[:,3]
-test_size = 0.33
-seed = 7
-X_train, X_test, Y_train, Y_test = model_selection.train_test_split(X, Y, test_size=test_size, random_state=seed)
-print(X_train.shape)
-# Fit the model on training set
-model = LogisticRegression(max_iter=1000)
-model.fit(X_train, Y_train)
-
-# save the model to disk
-filename = 'rgb_model.sav'
-pickle.dump(model, open(filename, 'wb'))
-
-
-# load the model from disk
-loaded_model = pickle.load(open(filename, 'rb'))
-result = loaded_model.score(X_test, Y_test)
-#print(result)
+"""Train the sticker colour model from a directory of sample shards.
+
+Shards are read a chunk at a time and fed to SGDClassifier.partial_fit, so a
+capture larger than memory trains fine.  Each sample is one sticker's B, G, R
+channel means and its label id (0-5, see image_processing.FACE_LETTERS):
+
+- .csv / .parquet: the first three columns, and a `label` column (else the fourth)
+- .npy: an (N, 4) array of B, G, R, label
+- .npz: `colors` (N, 3) and `labels` (N,) arrays
+
+With --white-balance each face of nine samples, in sticker order as
+capture_data.py writes them, is balanced against its centre before
+training, as image_processing does when scanning; shard lengths must then
+be multiples of 9.
+
+The same --seed gives the same train/test split and the same model.  Next
+to the model, <output>.report.json records held-out accuracy per class and
+the time to classify one face.
+
+    python color_train.py --data-dir samples/ -o model.npz
+    python color_train.py --data-dir samples/ -o model.npz --space lab --degree 2 --white-balance --lut-bits 6
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import timeit
+
+import numpy
+from sklearn.linear_model import SGDClassifier
+from sklearn.preprocessing import StandardScaler
+
+from color_features import SPACES, ColorFeatures, white_balance
+from image_processing import ColorLUT, LinearColorModel, balance_faces
+
+SHARD_TYPES = (".csv", ".parquet", ".npy", ".npz")
+CLASSES = numpy.arange(6)
+
+
+def export_model(coef, intercept, classes, filename, features=None, references=None, lut_bits=None,
+                 multi_class="ovr"):
+    """Write the fitted coefficients and intercepts for image_processing.LinearColorModel"""
+    extra = features.to_npz() if features is not None else {}
+    extra["multi_class"] = multi_class
+    if references is not None:
+        extra["references"] = references
+    if lut_bits:
+        extra["lut_bits"] = lut_bits
+    numpy.savez(filename, coef=coef, intercept=intercept, classes=classes, **extra)
+
+
+def classify(colors, model, predictor):
+    """Labels of (N, 3) sticker colours, whole faces in sticker order, as image_processing assigns them"""
+    if model.features.white_balance:
+        colors = balance_faces(colors.reshape(-1, 9, 3), model, predictor).reshape(-1, 3)
+    return predictor.predict(colors)
+
+
+def face_latency(model, predictor, repeat=2000):
+    """Microseconds to classify one 9-sticker face, through the calls classifiy_grid makes"""
+    face = numpy.random.default_rng(0).integers(0, 256, (9, 3))
+    return timeit.timeit(lambda: predictor.predict(balance_faces(face, model, predictor)),
+                         number=repeat) / repeat * 1e6
+
+
+def list_shards(data_dir):
+    shards = sorted(path for path in glob.glob(os.path.join(data_dir, "**", "*"), recursive=True)
+                    if path.endswith(SHARD_TYPES))
+    if not shards:
+        raise SystemExit(f"No {'/'.join(SHARD_TYPES)} shards in {data_dir}")
+    return shards
+
+
+def _frame_rows(frame):
+    labels = frame["label"] if "label" in frame.columns else frame.iloc[:, 3]
+    return frame.iloc[:, :3].to_numpy(dtype=numpy.float64), labels.to_numpy(dtype=numpy.int64)
+
+
+def read_shard(path, chunk_size):
+    """(colors, labels) chunks of at most `chunk_size` samples from one shard"""
+    if path.endswith(".csv"):
+        import pandas
+        for frame in pandas.read_csv(path, chunksize=chunk_size):
+            yield _frame_rows(frame)
+    elif path.endswith(".parquet"):
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet shards need the pyarrow package: pip install pyarrow")
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield _frame_rows(batch.to_pandas())
+    elif path.endswith(".npy"):
+        # memory-mapped, so only the current chunk is ever read in
+        samples = numpy.load(path, mmap_mode="r")
+        for start in range(0, len(samples), chunk_size):
+            chunk = numpy.asarray(samples[start:start + chunk_size])
+            yield chunk[:, :3].astype(numpy.float64), chunk[:, 3].astype(numpy.int64)
+    else:
+        with numpy.load(path) as shard:
+            colors, labels = shard["colors"], shard["labels"]
+        for start in range(0, len(colors), chunk_size):
+            yield (colors[start:start + chunk_size].astype(numpy.float64),
+                   labels[start:start + chunk_size].astype(numpy.int64))
+
+
+def iter_chunks(shards, chunk_size):
+    """((shard, chunk) index, colors, labels) taking chunks from the shards in turn
+
+    Captures are usually one colour per shard, so reading them round-robin
+    keeps every class in each training buffer.
+    """
+    readers = [(i, read_shard(path, chunk_size)) for i, path in enumerate(shards)]
+    counts = [0] * len(shards)
+    while readers:
+        for entry in list(readers):
+            i, reader = entry
+            chunk = next(reader, None)
+            if chunk is None:
+                readers.remove(entry)
+                continue
+            yield (i, counts[i]), chunk[0], chunk[1]
+            counts[i] += 1
+
+
+def test_mask(seed, key, n, test_size):
+    """Held-out rows of one chunk; depends only on the seed and the chunk, so every pass agrees
+
+    The nine samples of a face are held out together, so white balance
+    always sees whole faces.
+    """
+    return numpy.repeat(numpy.random.default_rng([seed, *key]).random(-(-n // 9)) < test_size, 9)[:n]
+
+
+class Trainer:
+    """Streaming SGD training of a linear model on color_features features
+
+    SGDClassifier's log loss fits one logistic regression per class
+    (one-vs-rest); the model file says so, and LinearColorModel.predict_proba
+    normalises the per-class sigmoids the same way scikit-learn does.
+    """
+
+    def __init__(self, features, seed=7, alpha=1e-5, classes=CLASSES, reference_samples=10000):
+        self.features = features
+        self.seed = seed
+        self.classes = classes
+        self.scaler = StandardScaler()
+        self.model = SGDClassifier(loss="log_loss", alpha=alpha, random_state=seed)
+        self.reference_samples = reference_samples
+        self.samples = {c: [] for c in classes}
+        self.kept = dict.fromkeys(classes, 0)
+        self.train_count = 0
+        self.reference_colors = None
+
+    def observe(self, colors, labels):
+        """First pass: feature scaling and the colours kept for white-balance references
+
+        The scaler sees unbalanced colours, as the references are not known
+        yet; it only conditions SGD and is folded out by weights().
+        """
+        self.scaler.partial_fit(self.features.transform(colors))
+        self.train_count += len(labels)
+        for c in self.classes:
+            room = self.reference_samples - self.kept[c]
+            if room > 0:
+                rows = colors[labels == c][:room]
+                self.samples[c].append(rows)
+                self.kept[c] += len(rows)
+
+    def references(self):
+        """Median BGR of each class, the white-balance target for centre stickers of that colour"""
+        return numpy.array([numpy.median(numpy.concatenate(self.samples[c]), axis=0)
+                            if self.kept[c] else numpy.full(3, 128.0) for c in self.classes])
+
+    def balance(self, colors, labels):
+        """White-balance whole faces against their centres' references, as image_processing does"""
+        if not self.features.white_balance:
+            return colors
+        if len(labels) % 9:
+            raise ValueError(f"White balance needs whole faces of 9 samples, got a chunk of {len(labels)}")
+        if self.reference_colors is None:
+            self.reference_colors = self.references()
+        faces = white_balance(colors.reshape(-1, 9, 3),
+                              self.reference_colors[numpy.searchsorted(self.classes, labels[4::9])])
+        return faces.reshape(-1, 3)
+
+    def fit(self, colors, labels, rng):
+        order = rng.permutation(len(labels))
+        features = self.scaler.transform(self.features.transform(colors[order]))
+        self.model.partial_fit(features, labels[order], classes=self.classes)
+
+    def weights(self):
+        """Coefficients and intercepts on unscaled features, folding in the scaler"""
+        coef = self.model.coef_ / self.scaler.scale_
+        intercept = self.model.intercept_ - coef @ self.scaler.mean_
+        return coef, intercept
+
+
+def train(shards, trainer, epochs, chunk_size, buffer_rows, test_size):
+    """Fit `trainer` with `epochs` passes over the training rows, shuffled `buffer_rows` at a time"""
+    for key, colors, labels in iter_chunks(shards, chunk_size):
+        train_rows = ~test_mask(trainer.seed, key, len(labels), test_size)
+        trainer.observe(colors[train_rows], labels[train_rows])
+    for epoch in range(epochs):
+        rng = numpy.random.default_rng([trainer.seed, epoch])
+        buffer, buffered = [], 0
+        for key, colors, labels in iter_chunks(shards, chunk_size):
+            train_rows = ~test_mask(trainer.seed, key, len(labels), test_size)
+            colors = trainer.balance(colors, labels)
+            buffer.append((colors[train_rows], labels[train_rows]))
+            buffered += int(train_rows.sum())
+            if buffered >= buffer_rows:
+                trainer.fit(*map(numpy.concatenate, zip(*buffer)), rng)
+                buffer, buffered = [], 0
+        if buffered:
+            trainer.fit(*map(numpy.concatenate, zip(*buffer)), rng)
+        print(f"epoch {epoch + 1}/{epochs} done", file=sys.stderr)
+
+
+def evaluate(shards, model, predictors, seed, chunk_size, test_size, classes=CLASSES):
+    """Confusion matrix (true x predicted) of each of `model`'s predictors on the held-out rows"""
+    confusion = {name: numpy.zeros((len(classes), len(classes)), dtype=numpy.int64) for name in predictors}
+    for key, colors, labels in iter_chunks(shards, chunk_size):
+        test_rows = test_mask(seed, key, len(labels), test_size)
+        if not test_rows.any():
+            continue
+        for name, predictor in predictors.items():
+            predicted = classify(colors[test_rows], model, predictor)
+            numpy.add.at(confusion[name], (numpy.searchsorted(classes, labels[test_rows]),
+                                           numpy.searchsorted(classes, predicted)), 1)
+    return confusion
+
+
+def accuracy_report(confusion, classes=CLASSES):
+    total = confusion.sum()
+    per_class = confusion.diagonal() / numpy.maximum(confusion.sum(axis=1), 1)
+    return {"accuracy": float(confusion.trace() / total) if total else None,
+            "per_class_accuracy": {int(c): float(a) for c, a in zip(classes, per_class)},
+            "confusion": confusion.tolist()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the sticker colour model from sample shards.")
+    parser.add_argument("--data-dir", required=True, help="directory of .csv, .parquet, .npy or .npz shards")
+    parser.add_argument("-o", "--output", default="model.npz", help="model file (default: model.npz)")
+    parser.add_argument("--space", choices=SPACES, default="bgr", help="colour features (default: bgr)")
+    parser.add_argument("--degree", type=int, choices=[1, 2], default=1, help="2 adds pairwise feature products")
+    parser.add_argument("--white-balance", action="store_true", help="normalise each face against its centre when scanning")
+    parser.add_argument("--lut-bits", type=int, help="serve the model from a 2**(3*bits) lookup table, e.g. 6 (256 KB)")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--alpha", type=float, default=1e-5, help="L2 regularisation strength")
+    parser.add_argument("--chunk-size", type=int, default=65536, help="samples read from a shard at a time, rounded down to whole faces")
+    parser.add_argument("--buffer-rows", type=int, default=262144, help="samples shuffled together per partial_fit")
+    parser.add_argument("--test-size", type=float, default=0.2, help="share of samples held out for the report")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    shards = list_shards(args.data_dir)
+    # chunks of whole faces, for white balance and the face-wise test split
+    chunk_size = max(args.chunk_size - args.chunk_size % 9, 9)
+    features = ColorFeatures(args.space, args.degree, args.white_balance)
+    trainer = Trainer(features, seed=args.seed, alpha=args.alpha)
+    start = time.perf_counter()
+    train(shards, trainer, args.epochs, chunk_size, args.buffer_rows, args.test_size)
+    train_seconds = time.perf_counter() - start
+
+    coef, intercept = trainer.weights()
+    export_model(coef, intercept, trainer.classes, args.output, features,
+                 trainer.references() if args.white_balance else None, args.lut_bits)
+    model = LinearColorModel.load(args.output)
+    predictors = {"model": model}
+    if args.lut_bits:
+        predictors["lut"] = ColorLUT.from_model(model, args.lut_bits)
+    confusion = evaluate(shards, model, predictors, args.seed, chunk_size, args.test_size)
+
+    report = {
+        "output": args.output,
+        "features": features.to_npz(),
+        "lut_bits": args.lut_bits,
+        "shards": len(shards),
+        "train_samples": trainer.train_count,
+        "test_samples": int(confusion["model"].sum()),
+        "epochs": args.epochs,
+        "seed": args.seed,
+        "train_seconds": round(train_seconds, 2),
+        "samples_per_second": round(trainer.train_count * args.epochs / train_seconds) if train_seconds else None,
+        "face_latency_us": {name: round(face_latency(model, predictor), 2) for name, predictor in predictors.items()},
+    }
+    for name, matrix in confusion.items():
+        report[name] = accuracy_report(matrix)
+    with open(os.path.splitext(args.output)[0] + ".report.json", "w") as f:
+        json.dump(report, f, indent=2)
+    for name in predictors:
+        print(f"{name}: accuracy {report[name]['accuracy']:.4f} on {report['test_samples']} held-out samples, "
+              f"{report['face_latency_us'][name]:.1f} us per face")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import numpy as np
+
+# Facelets are stored in Kociemba order: U R F D L B (white, red, green, yellow,
+# orange, blue), 9 stickers per face in reading order.  Values are the colour
+# ids produced by image_processing.classifiy_grid.
+FACE_ORDER = "URFDLB"
+FACE_LETTERS = "FURLBD"
+COLOR_IDS = {letter: i for i, letter in enumerate(FACE_LETTERS)}
+
+# outward normal of each face and the 3D position of each sticker on it
+_NORMALS = {"U": (0, 1, 0), "R": (1, 0, 0), "F": (0, 0, 1),
+            "D": (0, -1, 0), "L": (-1, 0, 0), "B": (0, 0, -1)}
+_POSITIONS = {
+    "U": lambda r, c: (c - 1, 1, r - 1),
+    "R": lambda r, c: (1, 1 - r, 1 - c),
+    "F": lambda r, c: (c - 1, 1 - r, 1),
+    "D": lambda r, c: (c - 1, -1, 1 - r),
+    "L": lambda r, c: (-1, 1 - r, c - 1),
+    "B": lambda r, c: (1 - c, 1 - r, -1),
+}
+
+
+def _facelet_geometry():
+    positions = np.zeros((54, 3), dtype=int)
+    normals = np.zeros((54, 3), dtype=int)
+    for f, face in enumerate(FACE_ORDER):
+        for i in range(9):
+            positions[9 * f + i] = _POSITIONS[face](i // 3, i % 3)
+            normals[9 * f + i] = _NORMALS[face]
+    return positions, normals
+
+
+_POS, _NORM = _facelet_geometry()
+_INDEX = {(tuple(p), tuple(n)): i for i, (p, n) in enumerate(zip(_POS, _NORM))}
+
+
+def _quarter_turn(axis, layer=None):
+    """Gather permutation for a clockwise quarter turn about the outward `axis`"""
+    axis = np.asarray(axis)
+    # clockwise seen from outside is a -90 degree rotation about the outward axis
+    x, y, z = axis
+    rotation = np.array([[x * x, x * y - z, x * z + y],
+                         [x * y + z, y * y, y * z - x],
+                         [x * z - y, y * z + x, z * z]]).T
+    perm = np.arange(54)
+    for i in range(54):
+        if layer is not None and _POS[i] @ axis != layer:
+            continue
+        j = _INDEX[(tuple(rotation @ _POS[i]), tuple(rotation @ _NORM[i]))]
+        perm[j] = i
+    return perm
+
+
+def compose(*perms):
+    """Single gather permutation equivalent to applying `perms` left to right"""
+    result = np.arange(54)
+    for perm in perms:
+        result = result[perm]
+    return result
+
+
+MOVES = {}
+for _face in FACE_ORDER:
+    _quarter = _quarter_turn(_NORMALS[_face], layer=1)
+    MOVES[_face] = _quarter
+    MOVES[_face + "2"] = compose(_quarter, _quarter)
+    MOVES[_face + "'"] = compose(_quarter, _quarter, _quarter)
+MOVE_NAMES = list(MOVES)
+
+# whole-cube rotations, named after the face turn they follow
+ROTATIONS = {"x": _quarter_turn(_NORMALS["R"]), "y": _quarter_turn(_NORMALS["U"]),
+             "z": _quarter_turn(_NORMALS["F"])}
+
+
+def _rotation_group():
+    """All 24 whole-cube orientations as gather permutations, identity first"""
+    group = [np.arange(54)]
+    seen = {group[0].tobytes()}
+    for perm in group:
+        for rotation in (ROTATIONS["x"], ROTATIONS["y"]):
+            candidate = compose(perm, rotation)
+            if candidate.tobytes() not in seen:
+                seen.add(candidate.tobytes())
+                group.append(candidate)
+    return np.array(group)
+
+
+ORIENTATIONS = _rotation_group()
+CENTERS = np.arange(4, 54, 9)
+
+SOLVED = np.repeat(np.array([COLOR_IDS[f] for f in FACE_ORDER], dtype=np.uint8), 9)
+
+
+def sequence_permutation(moves):
+    """Compose a move sequence ("R U R'" or a list of moves) into one permutation"""
+    if isinstance(moves, str):
+        moves = moves.split()
+    return compose(*(MOVES[m] for m in moves))
+
+
+class CubeState:
+    """54 facelet colour ids in one uint8 array; moves are single gathers"""
+
+    __slots__ = ("facelets",)
+
+    def __init__(self, facelets=None):
+        self.facelets = SOLVED.copy() if facelets is None else np.asarray(facelets, dtype=np.uint8)
+
+    @classmethod
+    def from_string(cls, cube_string):
+        """Build from a 54-character Kociemba facelet string"""
+        return cls([COLOR_IDS[c] for c in cube_string])
+
+    @classmethod
+    def from_sides(cls, white, red, green, yellow, orange, blue):
+        """Build from the per-face colour id lists kept by the front-ends"""
+        return cls(np.concatenate([white, red, green, yellow, orange, blue]))
+
+    def to_string(self):
+        return "".join(FACE_LETTERS[c] for c in self.facelets)
+
+    def sides(self):
+        """Per-face colour id lists in white, red, green, yellow, orange, blue order"""
+        return [self.facelets[9 * f:9 * f + 9].tolist() for f in range(6)]
+
+    def apply(self, moves):
+        """New state after a move or move sequence"""
+        if isinstance(moves, str) and moves in MOVES:
+            return CubeState(self.facelets[MOVES[moves]])
+        return CubeState(self.facelets[sequence_permutation(moves)])
+
+    def is_solved(self):
+        faces = self.facelets.reshape(6, 9)
+        return bool((faces == faces[:, 4:5]).all())
+
+    def __eq__(self, other):
+        return isinstance(other, CubeState) and np.array_equal(self.facelets, other.facelets)
+
+    def __repr__(self):
+        return f"CubeState({self.to_string()!r})"
+
+
+def apply_batch(states, moves):
+    """Apply one move sequence to an (N, 54) array of states in a single gather"""
+    return np.asarray(states)[:, sequence_permutation(moves)]
@@ -0,0 +1,238 @@
+from operator import itemgetter
+
+import numpy as np
+
+from two_phase import CORNER_FACELETS, EDGE_FACELETS
+
+FACE_ORDER = "URFDLB"
+# the front-ends name faces after their centre colour
+FACE_NAMES = ("White", "Red", "Green", "Yellow", "Orange", "Blue")
+COLOR_NAMES = dict(zip(FACE_ORDER, FACE_NAMES))
+_LETTERS = frozenset(FACE_ORDER)
+# column order of the colour classifier's probabilities (image_processing.FACE_LETTERS)
+CLASS_LETTERS = "FURLBD"
+
+
+def _cubie_lookup(cubies):
+    """Colours read at a position -> (cubie, orientation), for every rotation of every cubie"""
+    lookup = {}
+    for j, facelets in enumerate(cubies):
+        colors = tuple(FACE_ORDER[f // 9] for f in facelets)
+        for k in range(len(colors)):
+            lookup[colors[k:] + colors[:k]] = (j, -k % len(colors))
+    return lookup
+
+
+_CORNERS = _cubie_lookup(CORNER_FACELETS)
+_EDGES = _cubie_lookup(EDGE_FACELETS)
+_CORNER_READERS = [itemgetter(*facelets) for facelets in CORNER_FACELETS]
+_EDGE_READERS = [itemgetter(*facelets) for facelets in EDGE_FACELETS]
+_CORNER_NAMES = ["-".join(FACE_NAMES[f // 9].lower() for f in facelets) for facelets in CORNER_FACELETS]
+_EDGE_NAMES = ["-".join(FACE_NAMES[f // 9].lower() for f in facelets) for facelets in EDGE_FACELETS]
+
+
+class CubeProblem:
+    """One inconsistency, with the stickers it involves as (face name, 0-8 index) pairs"""
+
+    def __init__(self, message, facelets=()):
+        self.message = message
+        self.stickers = [(FACE_NAMES[f // 9], int(f % 9)) for f in facelets]
+
+    @property
+    def faces(self):
+        return sorted({face for face, _ in self.stickers}, key=FACE_NAMES.index)
+
+    def to_dict(self):
+        return {"message": self.message, "faces": self.faces,
+                "stickers": [{"face": face, "index": index} for face, index in self.stickers]}
+
+    def __repr__(self):
+        return f"CubeProblem({self.message!r})"
+
+
+class InvalidCube(ValueError):
+    """Raised by check() with every problem found"""
+
+    def __init__(self, problems):
+        super().__init__("; ".join(p.message for p in problems))
+        self.problems = problems
+
+
+def _parity(perm):
+    """0 for an even permutation, 1 for odd, by counting cycles"""
+    seen, cycles = [False] * len(perm), 0
+    for i in range(len(perm)):
+        if not seen[i]:
+            cycles += 1
+            while not seen[i]:
+                seen[i] = True
+                i = perm[i]
+    return (len(perm) - cycles) % 2
+
+
+def _check_cubies(cube_string, positions, readers, lookup, names, kind, problems):
+    """Identify the cubie at each position; returns (permutation, orientations) or None"""
+    perm, orientation, found = [], [], {}
+    for i, read in enumerate(readers):
+        colors = read(cube_string)
+        cubie = lookup.get(colors)
+        if cubie is None:
+            problems.append(CubeProblem(
+                f"The {kind} between the {names[i].replace('-', ', ')} faces reads "
+                f"{', '.join(COLOR_NAMES[c].lower() for c in colors)}, which no {kind} has", positions[i]))
+            continue
+        perm.append(cubie[0])
+        orientation.append(cubie[1])
+        found.setdefault(cubie[0], []).append(i)
+    for cubie, places in found.items():
+        if len(places) > 1:
+            problems.append(CubeProblem(f"The {names[cubie]} {kind} appears {len(places)} times",
+                                        [f for i in places for f in positions[i]]))
+    if len(perm) != len(positions) or len(found) != len(positions):
+        return None
+    return perm, orientation
+
+
+def validate(cube_string):
+    """Every inconsistency in a 54-facelet URFDLB string; an empty list means it can be solved
+
+    Checks sticker colours and counts, centres, that every corner and edge
+    is a real cubie present once, and the corner twist, edge flip and
+    permutation parity a scrambled (not reassembled) cube must have.
+    """
+    if len(cube_string) != 54:
+        return [CubeProblem(f"Expected 54 stickers, got {len(cube_string)}")]
+    if not _LETTERS.issuperset(cube_string):
+        unknown = [i for i, c in enumerate(cube_string) if c not in COLOR_NAMES]
+        return [CubeProblem(f"{len(unknown)} stickers have no colour", unknown)]
+    problems = []
+    for f, letter in enumerate(FACE_ORDER):
+        if cube_string[9 * f + 4] != letter:
+            problems.append(CubeProblem(f"The {FACE_NAMES[f]} face has a "
+                                        f"{COLOR_NAMES[cube_string[9 * f + 4]].lower()} centre", [9 * f + 4]))
+    for letter in FACE_ORDER:
+        count = cube_string.count(letter)
+        if count != 9:
+            problems.append(CubeProblem(f"{count} {COLOR_NAMES[letter].lower()} stickers instead of 9",
+                                        [i for i, c in enumerate(cube_string) if c == letter] if count > 9 else []))
+    corners = _check_cubies(cube_string, CORNER_FACELETS, _CORNER_READERS, _CORNERS, _CORNER_NAMES, "corner", problems)
+    edges = _check_cubies(cube_string, EDGE_FACELETS, _EDGE_READERS, _EDGES, _EDGE_NAMES, "edge", problems)
+    if corners is None or edges is None or problems:
+        return problems
+    if sum(corners[1]) % 3:
+        problems.append(CubeProblem("A corner is twisted in place"))
+    if sum(edges[1]) % 2:
+        problems.append(CubeProblem("An edge is flipped in place"))
+    if _parity(corners[0]) != _parity(edges[0]):
+        problems.append(CubeProblem("Two pieces are swapped"))
+    return problems
+
+
+def validate_faces(white, red, green, yellow, orange, blue):
+    """validate() for the six per-face strings kept by the front-ends"""
+    return validate(white + red + green + yellow + orange + blue)
+
+
+def check(cube_string):
+    """Raise InvalidCube unless `cube_string` is a solvable state"""
+    problems = validate(cube_string)
+    if problems:
+        raise InvalidCube(problems)
+
+
+def _ranked_cubies(log_p, positions, lookup, keep):
+    """Per position, the `keep` likeliest (log-probability, cubie, orientation, colours), best first"""
+    keys = list(lookup)
+    columns = np.array([[FACE_ORDER.index(c) for c in key] for key in keys])
+    facelets = np.asarray(positions)
+    scores = log_p[facelets[:, None, :], columns[None, :, :]].sum(axis=2)
+    ranked = []
+    for row in scores:
+        best = np.argsort(-row)[:keep]
+        ranked.append([(row[k], *lookup[keys[k]], keys[k]) for k in best])
+    return ranked
+
+
+def _best_by_parity(ranked, modulus, beam_width):
+    """Best assignment of distinct cubies to all positions with zero total orientation, per parity
+
+    Beam search over positions, keeping the `beam_width` likeliest partial
+    assignments.  Returns {parity: (log-probability, [colours per position])}.
+    """
+    beam = [(0.0, 0, 0, (), ())]
+    for candidates in ranked:
+        expanded = [(score + s, used | (1 << cubie), (twist + o) % modulus, perm + (cubie,), colors + (key,))
+                    for score, used, twist, perm, colors in beam
+                    for s, cubie, o, key in candidates if not used >> cubie & 1]
+        expanded.sort(key=lambda state: -state[0])
+        beam = expanded[:beam_width]
+    best = {}
+    for score, _, twist, perm, colors in beam:
+        parity = _parity(perm)
+        if twist == 0 and parity not in best:
+            best[parity] = (score, colors)
+    return best
+
+
+def correct(probabilities, letters=CLASS_LETTERS, max_changes=2, beam_width=256, keep=8):
+    """Most likely solvable state for per-sticker colour probabilities, or None
+
+    `probabilities` is (54, 6) in URFDLB sticker order with columns in
+    `letters` order.  Corners and edges are searched separately with a
+    bounded beam (their only shared constraint is parity), so a misread
+    sticker is replaced by the likeliest colour that makes every piece real
+    and unique.  Returns (cube string, changes) when the fix touches at most
+    `max_changes` stickers of the most likely reading, else None.  Centres
+    are fixed by definition, so a centre read as another colour counts as a
+    change too.
+    """
+    probabilities = np.asarray(probabilities, dtype=np.float64).reshape(54, len(letters))
+    order = [letters.index(letter) for letter in FACE_ORDER]
+    log_p = np.log(np.clip(probabilities[:, order], 1e-9, None))
+    corners = _best_by_parity(_ranked_cubies(log_p, CORNER_FACELETS, _CORNERS, keep), 3, beam_width)
+    edges = _best_by_parity(_ranked_cubies(log_p, EDGE_FACELETS, _EDGES, keep), 2, beam_width)
+    matches = [(corners[p][0] + edges[p][0], p) for p in (0, 1) if p in corners and p in edges]
+    if not matches:
+        return None
+    parity = max(matches)[1]
+    cube = list(FACE_ORDER[f // 9] for f in range(54))
+    for positions, colors in ((CORNER_FACELETS, corners[parity][1]), (EDGE_FACELETS, edges[parity][1])):
+        for facelets, key in zip(positions, colors):
+            for f, c in zip(facelets, key):
+                cube[f] = c
+    read = [FACE_ORDER[i] for i in log_p.argmax(axis=1)]
+    changes = [{"face": FACE_NAMES[f // 9], "index": f % 9, "from": COLOR_NAMES[read[f]].lower(),
+                "to": COLOR_NAMES[cube[f]].lower()} for f in range(54) if cube[f] != read[f]]
+    if len(changes) > max_changes:
+        return None
+    return "".join(cube), changes
+
+
+def validate_or_correct(cube_string, probabilities=None):
+    """(cube string, problems, changes) for a scanned state, fixing misread stickers when it can
+
+    `probabilities` is the (54, 6) input of correct(), or a function
+    returning it (or None), which is only called once the state fails
+    validation.  A corrected state comes back with no problems and its
+    changes; otherwise `changes` is None.
+    """
+    problems = validate(cube_string)
+    if not problems:
+        return cube_string, problems, None
+    if callable(probabilities):
+        probabilities = probabilities()
+    result = correct(probabilities) if probabilities is not None else None
+    if result is None:
+        return cube_string, problems, None
+    return result[0], [], result[1]
+
+
+def split_faces(cube_string):
+    """(face name, face string, classifier label ids) of each face of a URFDLB string"""
+    return [(face, cube_string[9 * i:9 * i + 9], [CLASS_LETTERS.index(c) for c in cube_string[9 * i:9 * i + 9]])
+            for i, face in enumerate(FACE_NAMES)]
+
+
+def describe_changes(changes):
+    """One line naming each corrected sticker, such as: Green #3 white → blue"""
+    return ", ".join(f"{c['face']} #{c['index'] + 1} {c['from']} → {c['to']}" for c in changes)
@@ -0,0 +1,15 @@
+import os
+
+from image_processing import load_color_model
+from kociemba_tables import warm_up
+
+bind = os.environ.get("BIND", "0.0.0.0:5001")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+# import the app once in the master so the workers fork from a warm process
+preload_app = True
+
+
+def on_starting(server):
+    """Load the colour model and Kociemba tables before forking; workers share them copy-on-write"""
+    load_color_model()
+    warm_up()
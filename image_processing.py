@@ -1,95 +1,415 @@
+import os
+import threading
 import cv2
 import numpy as np
-from sklearn.linear_model import LogisticRegression
-import pickle
-import pandas as pd
-import time
-loaded_model = pickle.load(open("model.sav", 'rb'))
+import metrics
+from color_features import ColorFeatures, robust_color, white_balance
 
-train_genration = True
 
+class LinearColorModel:
+    """Pure-NumPy evaluation of the exported logistic-regression colour model
 
-data = []
+    Takes BGR channel means and applies the model's color_features transform
+    itself.  `references` holds the per-class BGR targets for white balance,
+    `lut_bits` the LUT resolution the model was trained to be served with.
+    `multi_class` is "multinomial" for the shipped LogisticRegression and
+    "ovr" for color_train.py's one-vs-rest SGD model.
+    """
 
+    def __init__(self, coef, intercept, classes, features=None, references=None, lut_bits=None,
+                 multi_class="multinomial"):
+        self.coef_t = np.ascontiguousarray(np.asarray(coef, dtype=np.float64).T)
+        self.intercept = np.asarray(intercept, dtype=np.float64)
+        self.classes_ = np.asarray(classes)
+        self.features = features or ColorFeatures()
+        self.references = None
+        if references is not None:
+            # indexed by label id, so a prediction picks its reference directly
+            self.references = np.zeros((int(self.classes_.max()) + 1, 3))
+            self.references[self.classes_] = references
+        self.lut_bits = lut_bits
+        self.multi_class = multi_class
 
-def detect_grid(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    gray = cv2.blur(gray, (3, 3))
-    gray = cv2.adaptiveThreshold(gray,200,cv2.ADAPTIVE_THRESH_GAUSSIAN_C,cv2.THRESH_BINARY_INV,21,0)
-    contours, hierarchy = cv2.findContours(gray,cv2.RETR_CCOMP,cv2.CHAIN_APPROX_NONE)
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as weights:
+            references = weights["references"] if "references" in weights else None
+            lut_bits = int(weights["lut_bits"]) if "lut_bits" in weights else None
+            multi_class = str(weights["multi_class"]) if "multi_class" in weights else "multinomial"
+            return cls(weights["coef"], weights["intercept"], weights["classes"],
+                       ColorFeatures.from_npz(weights), references, lut_bits or None, multi_class)
+
+    def decision_function(self, X):
+        return self.features.transform(X) @ self.coef_t + self.intercept
+
+    def predict(self, X):
+        return self.classes_[self.decision_function(X).argmax(axis=1)]
+
+    def predict_proba(self, X):
+        """Class probabilities as scikit-learn computes them for the model's multi_class
+
+        A softmax of the decision function for multinomial models; for
+        one-vs-rest, each class's sigmoid, normalised to sum to one.
+        """
+        scores = self.decision_function(X)
+        if self.multi_class == "ovr":
+            np.negative(scores, out=scores)
+            np.exp(scores, out=scores)
+            scores += 1
+            np.reciprocal(scores, out=scores)
+        else:
+            scores -= scores.max(axis=1, keepdims=True)
+            np.exp(scores, out=scores)
+        scores /= scores.sum(axis=1, keepdims=True)
+        return scores
+
+
+class ColorLUT:
+    """Precomputed BGR -> label table, quantised to `bits` per channel"""
+
+    def __init__(self, table, classes):
+        # plain ndarray view: np.memmap indexing carries heavy per-call overhead
+        self.table = np.asarray(table)
+        self.flat = self.table.reshape(-1)
+        # indexing a memoryview returns a plain int, far cheaper than a NumPy scalar
+        self.view = memoryview(self.flat)
+        self.classes_ = np.asarray(classes)
+        self.bits = int(round(np.log2(table.shape[0])))
+        self.shift = 8 - self.bits
+        self.strides = np.array([1 << (2 * self.bits), 1 << self.bits, 1], dtype=np.intp)
+
+    @classmethod
+    def from_model(cls, model, bits=8):
+        size = 1 << bits
+        shift = 8 - bits
+        centers = (np.arange(size) << shift) + ((1 << shift) >> 1)
+        g, r = np.meshgrid(centers, centers, indexing="ij")
+        plane = np.empty((size * size, 3))
+        plane[:, 1] = g.ravel()
+        plane[:, 2] = r.ravel()
+        table = np.empty((size, size, size), dtype=np.uint8)
+        # one B plane at a time keeps the decision matrix small
+        for i, b in enumerate(centers):
+            plane[:, 0] = b
+            table[i] = model.decision_function(plane).argmax(axis=1).reshape(size, size)
+        return cls(table, model.classes_)
+
+    @classmethod
+    def cached(cls, model, filename, model_filename, bits=8):
+        """Load the table memory-mapped from disk, rebuilding it if the model is newer"""
+        if not os.path.exists(filename) or os.path.getmtime(filename) < os.path.getmtime(model_filename):
+            lut = cls.from_model(model, bits)
+            tmp = f"{filename}.{os.getpid()}.tmp"
+            with open(tmp, 'wb') as f:
+                np.save(f, lut.table)
+            os.replace(tmp, filename)
+        return cls(np.load(filename, mmap_mode='r'), model.classes_)
+
+    def predict_one(self, bgr):
+        """Label of a single colour, with integer arithmetic instead of array calls"""
+        b, g, r = (int(v) >> self.shift for v in np.asarray(bgr).tolist())
+        return self.classes_[self.view[(((b << self.bits) | g) << self.bits) | r]]
+
+    def predict(self, X):
+        # X holds 8-bit channel means, so the gather index is always in range
+        index = (np.asarray(X, dtype=np.intp) >> self.shift) @ self.strides
+        return self.classes_.take(self.flat.take(index))
+
+
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.path.join(MODEL_DIR, "model.npz")
+
+_model_lock = threading.RLock()
+loaded_model = None
+color_lut = None
+
+
+def load_color_model():
+    """Return the shared colour model, loading it on first use; call at startup to pre-warm"""
+    global loaded_model
+    if loaded_model is None:
+        with _model_lock:
+            if loaded_model is None:
+                model = LinearColorModel.load(MODEL_PATH)
+                bits = int(os.environ.get("CUBE_COLOR_LUT_BITS") or model.lut_bits or 0)
+                if bits:
+                    _load_color_lut(model, bits)
+                loaded_model = model
+    return loaded_model
+
+
+def _load_color_lut(model, bits):
+    global color_lut
+    filename = os.path.join(MODEL_DIR, f"model_lut{bits}.npy")
+    color_lut = ColorLUT.cached(model, filename, MODEL_PATH, bits)
+    return color_lut
+
+
+def enable_color_lut(bits=8):
+    """Classify stickers with a table lookup (256^3 = 16 MB at 8 bits, 64^3 = 256 KB at 6 bits)"""
+    model = load_color_model()
+    with _model_lock:
+        return _load_color_lut(model, bits)
+
+
+# per-sticker statistic: "mean" (integral image), or "median"/"trimmed" to shrug off glare
+STICKER_STAT = os.environ.get("CUBE_STICKER_STAT", "mean")
+
+
+def sticker_colors(image, rects):
+    """BGR colour (STICKER_STAT) and sort key of every (x, y, w, h) rectangle
+
+    Means come from one integral image over the stickers' bounding box.
+    """
+    rects = np.asarray(rects, dtype=np.intp).reshape(-1, 4)
+    grid = np.empty((len(rects), 4), dtype=int)
+    if len(rects) == 0:
+        return grid
+    height, width = image.shape[:2]
+    x0 = np.clip(rects[:, 0], 0, width)
+    y0 = np.clip(rects[:, 1], 0, height)
+    x1 = np.clip(rects[:, 0] + rects[:, 2], x0, width)
+    y1 = np.clip(rects[:, 1] + rects[:, 3], y0, height)
+    if STICKER_STAT != "mean":
+        for i in range(len(rects)):
+            grid[i, :3] = robust_color(image[y0[i]:y1[i], x0[i]:x1[i]], STICKER_STAT)
+    else:
+        # only integrate the region that actually contains stickers
+        ox, oy = x0.min(), y0.min()
+        integral = cv2.integral(image[oy:y1.max(), ox:x1.max()], sdepth=cv2.CV_32S)
+        x0, x1, y0, y1 = x0 - ox, x1 - ox, y0 - oy, y1 - oy
+        # int32 corners may wrap on large frames, but a single sticker's sum fits in
+        # 31 bits, so the wrapped differences are still exact
+        sums = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+        area = np.maximum((x1 - x0) * (y1 - y0), 1)
+        grid[:, :3] = sums[:, :3] / area[:, None]
+    grid[:, 3] = (50*rects[:, 1]) + (10*rects[:, 0])
+    return grid
+
+# detection parameters are tuned for webcam frames of this width
+REFERENCE_WIDTH = 640
+DETECT_WIDTH = 640
+
+def find_sticker_rects(image, scale=1.0):
+    """Inset (x, y, w, h) sticker rectangles, with area/threshold parameters scaled by `scale`"""
+    area_scale = scale * scale
+    block_size = max(3, int(round(21 * scale)) | 1)
+    with metrics.timer("threshold"):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        gray = cv2.blur(gray, (3, 3))
+        gray = cv2.adaptiveThreshold(gray,200,cv2.ADAPTIVE_THRESH_GAUSSIAN_C,cv2.THRESH_BINARY_INV,block_size,0)
+    with metrics.timer("contours"):
+        contours, hierarchy = cv2.findContours(gray,cv2.RETR_CCOMP,cv2.CHAIN_APPROX_NONE)
+        rects = []
+        for contour in contours:
+            A1 = cv2.contourArea(contour)
+            if A1 < 10000*area_scale and A1 > 1000*area_scale:
+                perimeter = cv2.arcLength(contour, True)
+                if cv2.norm(perimeter**2/16- A1) < 300*area_scale:
+                    rects.append(cv2.boundingRect(contour))
+    if len(rects) == 0:
+        return np.empty((0, 4), dtype=int)
+    inset = int(round(5 * scale))
+    return np.asarray(rects) + [inset, inset, -2*inset, -2*inset]
+
+def detection_scale(width, detect_width=None):
+    """Downscale factor and parameter scale used to detect on a frame `width` pixels wide"""
+    if not detect_width:
+        return 1.0, 1.0
+    factor = min(1.0, detect_width / width)
+    return factor, width * factor / REFERENCE_WIDTH
+
+def locate_stickers(image, factor=1.0, scale=1.0):
+    """Sticker rectangles in `image` coordinates, detected on a copy resized by `factor`"""
+    small = image
+    if factor != 1.0:
+        size = (int(round(image.shape[1] * factor)), int(round(image.shape[0] * factor)))
+        small = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    rects = find_sticker_rects(small, scale)
+    if factor != 1.0 and len(rects) > 0:
+        rects = np.round(rects / factor).astype(int)
+    return rects
+
+def mark_grid(image, rects, factor=1.0):
+    """Sample the sticker colours of `rects`, then outline them on the image"""
     grid = []
-    for contour in contours:
-        A1 = cv2.contourArea(contour)
-        if A1 < 10000 and A1 > 1000:
-            perimeter = cv2.arcLength(contour, True)
-            if cv2.norm(perimeter**2/16- A1) < 300:
-                x, y, w, h = cv2.boundingRect(contour)
-                x, y, w, h = x+5, y+5, w-10, h-10
-                object = np.array(cv2.mean(image[y:y+h,x:x+w])).astype(int)[:-1]
-                image = cv2.rectangle(image, (x, y), (x + w, y + h), (0, 0, 255), 2)
-                val = (50*y) + (10*x)
-                object = np.append(object,val)
-                grid.append(object)
-    if(len(grid)>0):
-        grid = np.asarray(grid)
+    if(len(rects)>0):
+        # sample every sticker before drawing so outlines never leak into the means
+        with metrics.timer("sample"):
+            grid = sticker_colors(image, rects)
+        thickness = max(2, int(round(2 / factor)))
+        for x, y, w, h in rects:
+            image = cv2.rectangle(image, (x, y), (x + w, y + h), (0, 0, 255), thickness)
         grid = grid[grid[:, -1].argsort()]
     return  image,grid
+
+def detect_grid(image, detect_width=None):
+    """Detect sticker grid; with detect_width, search a downscaled copy and sample at full resolution"""
+    with metrics.timer("detect_grid"):
+        factor, scale = detection_scale(image.shape[1], detect_width)
+        rects = locate_stickers(image, factor, scale)
+        return mark_grid(image, rects, factor)
+
+class GridTracker:
+    """Remember the last 9-sticker box and search only a padded region around it"""
+
+    def __init__(self, pad=0.5, detect_width=None):
+        self.pad = pad
+        self.detect_width = detect_width
+        self.box = None
+
+    def reset(self):
+        self.box = None
+
+    def _roi(self, shape):
+        x0, y0, x1, y1 = self.box
+        px, py = int((x1 - x0) * self.pad), int((y1 - y0) * self.pad)
+        return max(0, x0 - px), max(0, y0 - py), min(shape[1], x1 + px), min(shape[0], y1 + py)
+
+    def update(self, image):
+        """Drop-in replacement for detect_grid on consecutive video frames"""
+        factor, scale = detection_scale(image.shape[1], self.detect_width)
+        rects = []
+        if self.box is not None:
+            x0, y0, x1, y1 = self._roi(image.shape)
+            rects = locate_stickers(image[y0:y1, x0:x1], factor, scale)
+            if len(rects) == 9:
+                rects = rects + [x0, y0, 0, 0]
+        if len(rects) != 9:
+            # tracking lost: fall back to the full frame
+            rects = locate_stickers(image, factor, scale)
+        if len(rects) == 9:
+            self.box = (rects[:, 0].min(), rects[:, 1].min(),
+                        (rects[:, 0] + rects[:, 2]).max(), (rects[:, 1] + rects[:, 3]).max())
+        else:
+            self.box = None
+        return mark_grid(image, rects, factor)
+
+FACE_LETTERS = np.array(list("FURLBD"))
+
+def _color_predictor():
+    model = load_color_model()
+    return color_lut if color_lut is not None else model
+
+def balance_faces(colors, model=None, predictor=None):
+    """(..., 9, 3) sticker colours, white-balanced against their centres if the model was trained that way
+
+    `model` and `predictor` default to the shared model and its LUT, if any.
+    """
+    if model is None:
+        model = load_color_model()
+    if not model.features.white_balance:
+        return colors
+    if predictor is None:
+        predictor = _color_predictor()
+    colors = np.asarray(colors)
+    # the centre's class picks the colour it should read as under neutral light
+    if colors.ndim == 2 and isinstance(predictor, ColorLUT):
+        return white_balance(colors, model.references[predictor.predict_one(colors[4])])
+    centres = predictor.predict(colors[..., 4, :].reshape(-1, 3))
+    return white_balance(colors, model.references[centres].reshape(colors.shape[:-2] + (3,)))
+
 def classifiy_grid(grid):
     str = ""
     if(len(grid)==9):
         color = grid[:,0:3]
-        prediction = loaded_model.predict(color)
+        with metrics.timer("classify"):
+            prediction = _color_predictor().predict(balance_faces(color))
         #print(prediction)
-        for i in prediction:
-            if i == 0:
-                str+="F"
-            elif i == 1:
-                str+="U"
-            elif i == 2:
-                str+="R"
-            elif i == 3:
-                str+="L"
-            elif i == 4:
-                str+="B"
-            elif i == 5:
-                str+="D"
+        str = "".join(FACE_LETTERS[prediction])
     return str,prediction
-    
-def main():
-
-    vid = cv2.VideoCapture(0)
-    
-    while(True):
-
-        ret, frame = vid.read()
-        frame,grid = detect_grid(frame)
-        if(len(grid)==9):
-            c = grid[:,:3]
-            for i in grid:
-                c = i
-                c[3] = 5
-                data.append(c)
-            
-            time.sleep(0.2)
-            
-        cv2.imshow('frame', frame)
-
-        if len(data) > 1000:
-            break
-        if cv2.waitKey(1) & 0xFF == ord('q'): 
-            break
-
-    vid.release()
-    cv2.destroyAllWindows()
-
-if __name__ == '__main__':
-    main()
-    data = np.array(data)
-    
-
-    df = pd.DataFrame (data)
-    filepath = 'yellow.xlsx'
-    df.to_excel(filepath, index=False)
-    
-    print(data)
\ No newline at end of file
+
+def sticker_probabilities(colors):
+    """(..., 9, 6) class probabilities of (..., 9, 3) sticker colours, for cube_validator.correct
+
+    Several times slower than classifiy_grid and the LUT only stores labels,
+    so this is only worth calling once a scanned state fails validation.
+    """
+    model = load_color_model()
+    colors = np.asarray(colors, dtype=np.float64)
+    proba = model.predict_proba(balance_faces(colors).reshape(-1, 3))
+    return proba.reshape(colors.shape[:-1] + (proba.shape[1],))
+
+def classifiy_grids(grids):
+    """Classify an (N, 9, 3) batch of sticker colours with one predict call"""
+    grids = np.asarray(grids)
+    if grids.ndim != 3 or grids.shape[1:] != (9, 3):
+        raise ValueError(f"Expected an (N, 9, 3) array of sticker colours, got {grids.shape}")
+    if len(grids) == 0:
+        return [], np.empty((0, 9), dtype=int)
+    predictions = _color_predictor().predict(balance_faces(grids).reshape(-1, 3)).reshape(len(grids), 9)
+    strings = ["".join(letters) for letters in FACE_LETTERS[predictions]]
+    return strings, predictions
+
+class FaceStabilizer:
+    """Per-sticker majority vote over a ring buffer of the last `window` face predictions"""
+
+    def __init__(self, window=10, min_frames=5, threshold=0.7, n_classes=6):
+        self.window = window
+        self.min_frames = min_frames
+        self.threshold = threshold
+        self.history = np.zeros((window, 9), dtype=np.intp)
+        self.counts = np.zeros((9, n_classes), dtype=np.int32)
+        self.filled = 0
+        self.pos = 0
+        self.lock = threading.Lock()
+
+    _stickers = np.arange(9)
+
+    def reset(self):
+        with self.lock:
+            self.counts[:] = 0
+            self.filled = 0
+            self.pos = 0
+
+    def push(self, prediction):
+        """Add one frame's 9 label ids; O(1) regardless of the window size"""
+        prediction = np.asarray(prediction, dtype=np.intp)
+        with self.lock:
+            if self.filled == self.window:
+                self.counts[self._stickers, self.history[self.pos]] -= 1
+            else:
+                self.filled += 1
+            self.counts[self._stickers, prediction] += 1
+            self.history[self.pos] = prediction
+            self.pos = (self.pos + 1) % self.window
+
+    def confidence(self):
+        """Share of buffered frames agreeing with the majority, for the least certain sticker"""
+        with self.lock:
+            if self.filled == 0:
+                return 0.0
+            return float(self.counts.max(axis=1).min()) / self.filled
+
+    def vote(self):
+        """(face string, predictions, confidence) once there is a consistent majority, else None"""
+        with self.lock:
+            if self.filled < self.min_frames:
+                return None
+            prediction = self.counts.argmax(axis=1)
+            confidence = float(self.counts.max(axis=1).min()) / self.filled
+        if confidence < self.threshold:
+            return None
+        return "".join(FACE_LETTERS[prediction]), prediction, confidence
+
+    def probabilities(self):
+        """(9, n_classes) vote shares with add-one smoothing, so no colour is ruled out entirely"""
+        with self.lock:
+            return (self.counts + 1.0) / (self.filled + self.counts.shape[1])
+
+    def to_dict(self):
+        """Buffered frames and settings as plain lists, for session storage"""
+        with self.lock:
+            return {"window": self.window, "min_frames": self.min_frames, "threshold": self.threshold,
+                    "n_classes": self.counts.shape[1], "history": self.history[:self.filled].tolist(),
+                    "pos": self.pos}
+
+    @classmethod
+    def from_dict(cls, data):
+        stabilizer = cls(data["window"], data["min_frames"], data["threshold"], data["n_classes"])
+        history = np.asarray(data["history"], dtype=np.intp).reshape(-1, 9)
+        stabilizer.filled = len(history)
+        stabilizer.pos = data["pos"]
+        stabilizer.history[:stabilizer.filled] = history
+        np.add.at(stabilizer.counts, (np.tile(cls._stickers, len(history)), history.ravel()), 1)
+        return stabilizer
@@ -0,0 +1,8 @@
+"""Forkserver preload for solver_pool.
+
+Importing this loads the Kociemba tables once in the fork server, so every
+solver worker forked from it starts warm and shares those pages copy-on-write.
+"""
+from kociemba_tables import warm_up
+
+warm_up()
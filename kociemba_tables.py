@@ -0,0 +1,68 @@
+import os
+import shutil
+import sys
+import threading
+import time
+
+import kociemba
+
+# solving any real state makes kociemba load its pruning tables
+WARMUP_STATE = "DRLUUBFBRBLURRLRUBLRDDFDLFUFUFFDBRDUBRUFLLFDDBFLUBLRBD"
+
+_lock = threading.Lock()
+_warm_time = None
+
+
+def configure(table_dir=None):
+    """Point kociemba at a shared table directory, seeding it from the bundled tables
+
+    The directory comes from `table_dir` or CUBE_KOCIEMBA_TABLES; put it on a
+    tmpfs such as /dev/shm so loading them never touches the disk.  Only the
+    file reads are shared: kociemba freads the tables into its own heap, so
+    each process that loads them still holds a private copy (forked workers
+    share their parent's copy-on-write instead).
+    """
+    table_dir = table_dir or os.environ.get("CUBE_KOCIEMBA_TABLES")
+    if not table_dir:
+        return kociemba.cache_dir
+    bundled = os.path.join(os.path.dirname(kociemba.__file__), "cprunetables")
+    os.makedirs(table_dir, exist_ok=True)
+    if os.path.isdir(bundled):
+        for name in os.listdir(bundled):
+            target = os.path.join(table_dir, name)
+            if not os.path.exists(target):
+                tmp = f"{target}.{os.getpid()}.tmp"
+                shutil.copyfile(os.path.join(bundled, name), tmp)
+                os.replace(tmp, target)
+    kociemba.cache_dir = table_dir
+    return table_dir
+
+
+def warm_up():
+    """Load the pruning tables into this process once; returns the seconds it took"""
+    global _warm_time
+    with _lock:
+        if _warm_time is None:
+            configure()
+            start = time.perf_counter()
+            kociemba.solve(WARMUP_STATE)
+            _warm_time = time.perf_counter() - start
+    return _warm_time
+
+
+def memory_usage(pid="self"):
+    """Rss, Pss and private/shared memory of a process in kB (Linux only)"""
+    usage = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            fields = line.split()
+            if fields[0].rstrip(":") in ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty"):
+                usage[fields[0].rstrip(":")] = int(fields[1])
+    return usage
+
+
+if __name__ == "__main__":
+    print(f"tables: {configure(sys.argv[1] if len(sys.argv) > 1 else None)}")
+    print(f"warm-up: {warm_up() * 1000:.1f} ms")
+    if os.path.exists("/proc/self/smaps_rollup"):
+        print(f"memory: {memory_usage()}")
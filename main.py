@@ -1,11 +1,71 @@
 from tkinter import *
 from tkinter import ttk
+from tkinter import messagebox
 from turtle import update
 import cv2
 import numpy as np
 from PIL import ImageTk, Image
 from image_processing import *
-import kociemba
+import solution_cache
+from cube_validator import FACE_NAMES, describe_changes, split_faces, validate_or_correct
+from cube_state import CubeState
+import queue
+import threading
+import time
+
+class FrameWorker(threading.Thread):
+    """Capture and detect on a background thread, keeping only the newest frames"""
+
+    def __init__(self, cap, tracker, stabilizer, size=(512,384), maxsize=2):
+        super().__init__(daemon=True)
+        self.cap = cap
+        self.tracker = tracker
+        self.stabilizer = stabilizer
+        self.size = size
+        self.frames = queue.Queue(maxsize=maxsize)
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            ret, frame = self.cap.read()
+            if not ret:
+                time.sleep(0.03)
+                continue
+            frame, grid = self.tracker.update(frame)
+            if len(grid) == 9:
+                _, prediction = classifiy_grid(grid)
+                self.stabilizer.push(prediction)
+            frame = cv2.resize(frame, self.size)
+            img = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            self.put((img, grid))
+
+    def put(self, item):
+        # drop the oldest frame instead of blocking the capture loop
+        while True:
+            try:
+                self.frames.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def latest(self):
+        item = None
+        while True:
+            try:
+                item = self.frames.get_nowait()
+            except queue.Empty:
+                return item
+
+    def stop(self):
+        self.stopped.set()
+        self.join(timeout=1)
+
+# side attribute turned by each face move
+MOVE_SIDES = {"U": "white_side", "R": "red_side", "F": "green_side",
+              "D": "yellow_side", "L": "orange_side", "B": "blue_side"}
 
 class gui:
     grid = []
@@ -127,60 +187,72 @@ class gui:
         return image
    
     def scan_green(self):
-        if(len(self.face) == 9):
-            self.green_str,green_side = classifiy_grid(self.face)
+        stable = self.stabilizer.vote()
+        if stable is not None:
+            self.green_str,green_side,confidence = stable
             if(green_side[4] == 0):
                 self.green_side = green_side
+                self.probabilities["Green"] = self.stabilizer.probabilities()
                 img0 = self.get_face_rep(self.green_side)
                 self.panel0 = Label(self.root, image=img0)
                 self.panel0.image = img0
                 self.panel0.place(x=370,y=190,in_=self.root)
     
     def scan_white(self):
-        if(len(self.face) == 9):
-            self.white_str,side = classifiy_grid(self.face)
+        stable = self.stabilizer.vote()
+        if stable is not None:
+            self.white_str,side,confidence = stable
             if(side[4] == 1):
                 self.white_side = side
+                self.probabilities["White"] = self.stabilizer.probabilities()
                 img1 = self.get_face_rep(self.white_side)
                 self.panel1 = Label(self.root, image=img1)
                 self.panel1.image = img1
                 self.panel1.place(x=370,y=40,in_=self.root)
 
     def scan_red(self):
-        if(len(self.face) == 9):
-            self.red_str,side = classifiy_grid(self.face)
+        stable = self.stabilizer.vote()
+        if stable is not None:
+            self.red_str,side,confidence = stable
             if(side[4] == 2):
                 self.red_side = side
+                self.probabilities["Red"] = self.stabilizer.probabilities()
                 img2 = self.get_face_rep(self.red_side)
                 self.panel2 = Label(self.root, image=img2)
                 self.panel2.image = img2
                 self.panel2.place(x=520,y=190,in_=self.root)
 
     def scan_orange(self):
-        if(len(self.face) == 9):
-            self.orange_str,side = classifiy_grid(self.face)
+        stable = self.stabilizer.vote()
+        if stable is not None:
+            self.orange_str,side,confidence = stable
             if(side[4] == 3):
                 self.orange_side = side
+                self.probabilities["Orange"] = self.stabilizer.probabilities()
                 img3 = self.get_face_rep(self.orange_side)
                 self.panel3 = Label(self.root, image=img3)
                 self.panel3.image = img3
                 self.panel3.place(x=220,y=190,in_=self.root)
 
     def scan_blue(self):
-        if(len(self.face) == 9):
-            self.blue_str,side = classifiy_grid(self.face)
+        stable = self.stabilizer.vote()
+        if stable is not None:
+            self.blue_str,side,confidence = stable
             if(side[4] == 4):
                 self.blue_side = side
+                self.probabilities["Blue"] = self.stabilizer.probabilities()
                 img4 = self.get_face_rep(self.blue_side)
                 self.panel4 = Label(self.root, image=img4)
                 self.panel4.image = img4
                 self.panel4.place(x=70,y=190,in_=self.root)
 
     def scan_yellow(self):
-        if(len(self.face) == 9):
-            self.yellow_str,side = classifiy_grid(self.face)
+        stable = self.stabilizer.vote()
+        if stable is not None:
+            self.yellow_str,side,confidence = stable
             if(side[4] == 5):
                 self.yellow_side = side
+                self.probabilities["Yellow"] = self.stabilizer.probabilities()
                 img5 = self.get_face_rep(self.yellow_side)
                 self.panel5 = Label(self.root, image=img5)
                 self.panel5.image = img5
@@ -235,6 +307,8 @@ class gui:
         self.orange_side = [3,3,3,3,3,3,3,3,3]
         self.white_side = [1,1,1,1,1,1,1,1,1]
         self.red_side = [2,2,2,2,2,2,2,2,2]
+        self.probabilities = {}
+        self.stabilizer.reset()
         self.update_grid_status()
         self.panel.destroy()
 
@@ -254,297 +328,15 @@ class gui:
         except:
             pass
         if self.solve_status and self.sollution != []:
-            
-            if self.sollution[0] == "U":
-                img = self.get_face_rep_with_arrow(self.white_side,True,False)
-                self.panel = Label(self.root, image=img)
-                self.panel.image = img
-                self.panel.place(x=1000,y=450,in_=self.root)
-
-                temp1 = [self.green_side[0],self.green_side[1],self.green_side[2]]
-                self.green_side[0],self.green_side[1],self.green_side[2] = self.red_side[0],self.red_side[1],self.red_side[2]
-                self.red_side[0],self.red_side[1],self.red_side[2] =self.blue_side[0],self.blue_side[1],self.blue_side[2]
-                self.blue_side[0],self.blue_side[1],self.blue_side[2] = self.orange_side[0],self.orange_side[1],self.orange_side[2]
-                self.orange_side[0],self.orange_side[1],self.orange_side[2] = temp1[0],temp1[1],temp1[2]
-                temp2 = self.white_side
-                self.white_side = [temp2[6],temp2[3],temp2[0],temp2[7],temp2[4],temp2[1],temp2[8],temp2[5],temp2[2]]
-                self.update_grid_status()
-            
-            elif self.sollution[0] == "U2":
-                img = self.get_face_rep_with_arrow(self.white_side,True,True)
-                self.panel = Label(self.root, image=img)
-                self.panel.image = img
-                self.panel.place(x=1000,y=450,in_=self.root)
-
-                temp1 = [self.green_side[0],self.green_side[1],self.green_side[2]]
-                temp2 = [self.red_side[0],self.red_side[1],self.red_side[2]]
-                self.green_side[0],self.green_side[1],self.green_side[2] = self.blue_side[0],self.blue_side[1],self.blue_side[2]
-                self.red_side[0],self.red_side[1],self.red_side[2] = self.orange_side[0],self.orange_side[1],self.orange_side[2]
-                self.blue_side[0],self.blue_side[1],self.blue_side[2] = temp1[0],temp1[1],temp1[2]
-                self.orange_side[0],self.orange_side[1],self.orange_side[2] = temp2[0],temp2[1],temp2[2]
-                temp3 = self.white_side
-                self.white_side = [temp3[8],temp3[7],temp3[6],temp3[5],temp3[4],temp3[3],temp3[2],temp3[1],temp3[0]]
-                self.update_grid_status()
-            
-            elif self.sollution[0] == "U'":
-                img = self.get_face_rep_with_arrow(self.white_side,False,False)
-                self.panel = Label(self.root, image=img)
-                self.panel.image = img
-                self.panel.place(x=1000,y=450,in_=self.root)            
-                temp1 = [self.green_side[0],self.green_side[1],self.green_side[2]]
-                self.green_side[0],self.green_side[1],self.green_side[2] = self.orange_side[0],self.orange_side[1],self.orange_side[2]
-                self.orange_side[0],self.orange_side[1],self.orange_side[2] =self.blue_side[0],self.blue_side[1],self.blue_side[2]
-                self.blue_side[0],self.blue_side[1],self.blue_side[2] = self.red_side[0],self.red_side[1],self.red_side[2]
-                self.red_side[0],self.red_side[1],self.red_side[2] = temp1[0],temp1[1],temp1[2]
-                temp2 = self.white_side
-                self.white_side = [temp2[2],temp2[5],temp2[8],temp2[1],temp2[4],temp2[7],temp2[0],temp2[3],temp2[6]]
-                self.update_grid_status()
-            
-
+            move = self.sollution[0]
+            img = self.get_face_rep_with_arrow(getattr(self, MOVE_SIDES[move[0]]),not move.endswith("'"),move.endswith("2"))
+            self.panel = Label(self.root, image=img)
+            self.panel.image = img
+            self.panel.place(x=1000,y=450,in_=self.root)
 
-
-
-            elif self.sollution[0] == "R":
-                img = self.get_face_rep_with_arrow(self.red_side,True,False)
-                self.panel = Label(self.root, image=img)
-                self.panel.image = img
-                self.panel.place(x=1000,y=450,in_=self.root)
-
-                temp1 = [self.green_side[2],self.green_side[5],self.green_side[8]]
-                self.green_side[2],self.green_side[5],self.green_side[8] = self.yellow_side[2],self.yellow_side[5],self.yellow_side[8]
-                self.yellow_side[2],self.yellow_side[5],self.yellow_side[8] = self.blue_side[6],self.blue_side[3],self.blue_side[0]
-                self.blue_side[6],self.blue_side[3],self.blue_side[0] = self.white_side[2],self.white_side[5],self.white_side[8]
-                self.white_side[2],self.white_side[5],self.white_side[8] = temp1[0],temp1[1],temp1[2]
-                temp2 = self.red_side
-                self.red_side = [temp2[6],temp2[3],temp2[0],temp2[7],temp2[4],temp2[1],temp2[8],temp2[5],temp2[2]]
-                self.update_grid_status()
-
-            elif self.sollution[0] == "R2":
-                img = self.get_face_rep_with_arrow(self.red_side,True,True)
-                self.panel = Label(self.root, image=img)
-                self.panel.image = img
-                self.panel.place(x=1000,y=450,in_=self.root)
-
-                temp1 = [self.green_side[2],self.green_side[5],self.green_side[8]]
-                temp2 = [self.white_side[2],self.white_side[5],self.white_side[8]]
-                self.green_side[2],self.green_side[5],self.green_side[8] = self.blue_side[6],self.blue_side[3],self.blue_side[0]
-                self.white_side[2],self.white_side[5],self.white_side[8] = self.yellow_side[2],self.yellow_side[5],self.yellow_side[8]
-                self.blue_side[6],self.blue_side[3],self.blue_side[0] = temp1[0],temp1[1],temp1[2]
-                self.yellow_side[2],self.yellow_side[5],self.yellow_side[8] = temp2[0],temp2[1],temp2[2]
-                temp3 = self.red_side
-                self.red_side = [temp3[8],temp3[7],temp3[6],temp3[5],temp3[4],temp3[3],temp3[2],temp3[1],temp3[0]]
-                self.update_grid_status()
-
-            elif self.sollution[0] == "R'":
-                img = self.get_face_rep_with_arrow(self.red_side,False,False)
-                self.panel = Label(self.root, image=img)
-                self.panel.image = img
-                self.panel.place(x=1000,y=450,in_=self.root) 
-
-                temp1 = [self.green_side[2],self.green_side[5],self.green_side[8]]
-                self.green_side[2],self.green_side[5],self.green_side[8] = self.white_side[2],self.white_side[5],self.white_side[8]
-                self.white_side[2],self.white_side[5],self.white_side[8] = self.blue_side[6],self.blue_side[3],self.blue_side[0]
-                self.blue_side[6],self.blue_side[3],self.blue_side[0] = self.yellow_side[2],self.yellow_side[5],self.yellow_side[8]
-                self.yellow_side[2],self.yellow_side[5],self.yellow_side[8] = temp1[0],temp1[1],temp1[2]
-                temp2 = self.red_side
-                self.red_side = [temp2[2],temp2[5],temp2[8],temp2[1],temp2[4],temp2[7],temp2[0],temp2[3],temp2[6]]
-                self.update_grid_status()
-
-
-
-
-            elif self.sollution[0] == "L":
-                img = self.get_face_rep_with_arrow(self.orange_side,True,False)
-                self.panel = Label(self.root, image=img)
-                self.panel.image = img
-                self.panel.place(x=1000,y=450,in_=self.root)
-
-                temp1 = [self.green_side[0],self.green_side[3],self.green_side[6]]
-                self.green_side[0],self.green_side[3],self.green_side[6] = self.white_side[0],self.white_side[3],self.white_side[6]
-                self.white_side[0],self.white_side[3],self.white_side[6] = self.blue_side[8],self.blue_side[5],self.blue_side[2]
-                self.blue_side[8],self.blue_side[5],self.blue_side[2] = self.yellow_side[0],self.yellow_side[3],self.yellow_side[6]
-                self.yellow_side[0],self.yellow_side[3],self.yellow_side[6] = temp1[0],temp1[1],temp1[2]
-                temp2 = self.orange_side
-                self.orange_side = [temp2[6],temp2[3],temp2[0],temp2[7],temp2[4],temp2[1],temp2[8],temp2[5],temp2[2]]
-                self.update_grid_status()
-
-            elif self.sollution[0] == "L2":
-                img = self.get_face_rep_with_arrow(self.orange_side,True,True)
-                self.panel = Label(self.root, image=img)
-                self.panel.image = img
-                self.panel.place(x=1000,y=450,in_=self.root)
-
-                temp1 = [self.green_side[0],self.green_side[3],self.green_side[6]]
-                temp2 = [self.white_side[0],self.white_side[3],self.white_side[6]]
-                self.green_side[0],self.green_side[3],self.green_side[6] = self.blue_side[8],self.blue_side[5],self.blue_side[2]
-                self.white_side[0],self.white_side[3],self.white_side[6] =  self.yellow_side[0],self.yellow_side[3],self.yellow_side[6]
-                self.blue_side[8],self.blue_side[5],self.blue_side[2] = temp1[0],temp1[1],temp1[2]
-                self.yellow_side[0],self.yellow_side[3],self.yellow_side[6] = temp2[0],temp2[1],temp2[2]
-                temp3 = self.orange_side
-                self.orange_side = [temp3[8],temp3[7],temp3[6],temp3[5],temp3[4],temp3[3],temp3[2],temp3[1],temp3[0]]
-                self.update_grid_status()
-
-            elif self.sollution[0] == "L'":
-                img = self.get_face_rep_with_arrow(self.orange_side,False,False)
-                self.panel = Label(self.root, image=img)
-                self.panel.image = img
-                self.panel.place(x=1000,y=450,in_=self.root)
-
-                temp1 = [self.green_side[0],self.green_side[3],self.green_side[6]]
-                self.green_side[0],self.green_side[3],self.green_side[6] = self.yellow_side[0],self.yellow_side[3],self.yellow_side[6]
-                self.yellow_side[0],self.yellow_side[3],self.yellow_side[6] = self.blue_side[8],self.blue_side[5],self.blue_side[2]
-                self.blue_side[8],self.blue_side[5],self.blue_side[2] = self.white_side[0],self.white_side[3],self.white_side[6]
-                self.white_side[0],self.white_side[3],self.white_side[6] = temp1[0],temp1[1],temp1[2]
-                temp2 = self.orange_side
-                self.orange_side =  [temp2[2],temp2[5],temp2[8],temp2[1],temp2[4],temp2[7],temp2[0],temp2[3],temp2[6]]
-                self.update_grid_status()
-
-
-
-
-            elif self.sollution[0] == "B":
-                img = self.get_face_rep_with_arrow(self.blue_side,True,False)
-                self.panel = Label(self.root, image=img)
-                self.panel.image = img
-                self.panel.place(x=1000,y=450,in_=self.root)
-
-                temp1 = [self.white_side[2],self.white_side[1],self.white_side[0]]
-                self.white_side[2],self.white_side[1],self.white_side[0] = self.red_side[8],self.red_side[5],self.red_side[2]
-                self.red_side[8],self.red_side[5],self.red_side[2] = self.yellow_side[6],self.yellow_side[7],self.yellow_side[8]
-                self.yellow_side[6],self.yellow_side[7],self.yellow_side[8] = self.orange_side[0],self.orange_side[3],self.orange_side[6]
-                self.orange_side[0],self.orange_side[3],self.orange_side[6] = temp1[0],temp1[1],temp1[2]
-                temp2 = self.blue_side
-                self.blue_side = [temp2[6],temp2[3],temp2[0],temp2[7],temp2[4],temp2[1],temp2[8],temp2[5],temp2[2]]
-                self.update_grid_status()
-            elif self.sollution[0] == "B2":
-                img = self.get_face_rep_with_arrow(self.blue_side,True,True)
-                self.panel = Label(self.root, image=img)
-                self.panel.image = img
-                self.panel.place(x=1000,y=450,in_=self.root)
-
-                temp1 = [self.white_side[2],self.white_side[1],self.white_side[0]]
-                temp2 = [self.red_side[8],self.red_side[5],self.red_side[2]]
-                self.white_side[2],self.white_side[1],self.white_side[0] = self.yellow_side[6],self.yellow_side[7],self.yellow_side[8]
-                self.red_side[8],self.red_side[5],self.red_side[2] =  self.orange_side[0],self.orange_side[3],self.orange_side[6]
-                self.yellow_side[6],self.yellow_side[7],self.yellow_side[8] = temp1[0],temp1[1],temp1[2]
-                self.orange_side[0],self.orange_side[3],self.orange_side[6] = temp2[0],temp2[1],temp2[2]
-                temp3 = self.blue_side
-                self.blue_side = [temp3[8],temp3[7],temp3[6],temp3[5],temp3[4],temp3[3],temp3[2],temp3[1],temp3[0]]
-                self.update_grid_status()
-
-            elif self.sollution[0] == "B'":
-                img = self.get_face_rep_with_arrow(self.blue_side,False,False)
-                self.panel = Label(self.root, image=img)
-                self.panel.image = img
-                self.panel.place(x=1000,y=450,in_=self.root)                
-
-                temp1 = [self.white_side[2],self.white_side[1],self.white_side[0]]
-                self.white_side[2],self.white_side[1],self.white_side[0] = self.orange_side[0],self.orange_side[3],self.orange_side[6]
-                self.orange_side[0],self.orange_side[3],self.orange_side[6] = self.yellow_side[6],self.yellow_side[7],self.yellow_side[8]
-                self.yellow_side[6],self.yellow_side[7],self.yellow_side[8] = self.red_side[8],self.red_side[5],self.red_side[2]
-                self.red_side[8],self.red_side[5],self.red_side[2] = temp1[0],temp1[1],temp1[2]
-                temp2 = self.blue_side
-                self.blue_side =  [temp2[2],temp2[5],temp2[8],temp2[1],temp2[4],temp2[7],temp2[0],temp2[3],temp2[6]]
-                self.update_grid_status()
-
-
-
-
-            elif self.sollution[0] == "F":
-                img = self.get_face_rep_with_arrow(self.green_side,True,False)
-                self.panel = Label(self.root, image=img)
-                self.panel.image = img
-                self.panel.place(x=1000,y=450,in_=self.root)
-
-                temp1 = [self.white_side[6],self.white_side[7],self.white_side[8]]
-                self.white_side[6],self.white_side[7],self.white_side[8] = self.orange_side[8],self.orange_side[5],self.orange_side[2]
-                self.orange_side[8],self.orange_side[5],self.orange_side[2] = self.yellow_side[2],self.yellow_side[1],self.yellow_side[0]
-                self.yellow_side[2],self.yellow_side[1],self.yellow_side[0] = self.red_side[0],self.red_side[3],self.red_side[6]
-                self.red_side[0],self.red_side[3],self.red_side[6] = temp1[0],temp1[1],temp1[2]
-                temp2 = self.green_side
-                self.green_side = [temp2[6],temp2[3],temp2[0],temp2[7],temp2[4],temp2[1],temp2[8],temp2[5],temp2[2]]
-                self.update_grid_status()
-
-            elif self.sollution[0] == "F2":
-                img = self.get_face_rep_with_arrow(self.green_side,True,True)
-                self.panel = Label(self.root, image=img)
-                self.panel.image = img
-                self.panel.place(x=1000,y=450,in_=self.root)
-
-                temp1 = [self.white_side[6],self.white_side[7],self.white_side[8]]
-                temp2 = [self.red_side[0],self.red_side[3],self.red_side[6]]
-                self.white_side[6],self.white_side[7],self.white_side[8] = self.yellow_side[2],self.yellow_side[1],self.yellow_side[0]
-                self.red_side[0],self.red_side[3],self.red_side[6] =  self.orange_side[8],self.orange_side[5],self.orange_side[2]
-                self.yellow_side[2],self.yellow_side[1],self.yellow_side[0] = temp1[0],temp1[1],temp1[2]
-                self.orange_side[8],self.orange_side[5],self.orange_side[2] = temp2[0],temp2[1],temp2[2]
-                temp3 = self.green_side
-                self.green_side = [temp3[8],temp3[7],temp3[6],temp3[5],temp3[4],temp3[3],temp3[2],temp3[1],temp3[0]]
-                self.update_grid_status()
-
-            elif self.sollution[0] == "F'":
-                img = self.get_face_rep_with_arrow(self.green_side,False,False)
-                self.panel = Label(self.root, image=img)
-                self.panel.image = img
-                self.panel.place(x=1000,y=450,in_=self.root)
-
-                temp1 = [self.white_side[6],self.white_side[7],self.white_side[8]]
-                self.white_side[6],self.white_side[7],self.white_side[8] = self.red_side[0],self.red_side[3],self.red_side[6]
-                self.red_side[0],self.red_side[3],self.red_side[6] = self.yellow_side[2],self.yellow_side[1],self.yellow_side[0]
-                self.yellow_side[2],self.yellow_side[1],self.yellow_side[0] = self.orange_side[8],self.orange_side[5],self.orange_side[2]
-                self.orange_side[8],self.orange_side[5],self.orange_side[2] = temp1[0],temp1[1],temp1[2]
-                temp2 = self.green_side
-                self.green_side =  [temp2[2],temp2[5],temp2[8],temp2[1],temp2[4],temp2[7],temp2[0],temp2[3],temp2[6]]
-                self.update_grid_status()
-
-
-
-
-
-            elif self.sollution[0] == "D":
-                img = self.get_face_rep_with_arrow(self.yellow_side,True,False)
-                self.panel = Label(self.root, image=img)
-                self.panel.image = img
-                self.panel.place(x=1000,y=450,in_=self.root)
-
-                temp1 = [self.green_side[6],self.green_side[7],self.green_side[8]]
-                self.green_side[6],self.green_side[7],self.green_side[8] = self.orange_side[6],self.orange_side[7],self.orange_side[8]
-                self.orange_side[6],self.orange_side[7],self.orange_side[8] = self.blue_side[6],self.blue_side[7],self.blue_side[8]
-                self.blue_side[6],self.blue_side[7],self.blue_side[8] = self.red_side[6],self.red_side[7],self.red_side[8]
-                self.red_side[6],self.red_side[7],self.red_side[8] = temp1[0],temp1[1],temp1[2]
-                temp2 = self.yellow_side
-                self.yellow_side = [temp2[6],temp2[3],temp2[0],temp2[7],temp2[4],temp2[1],temp2[8],temp2[5],temp2[2]]
-                self.update_grid_status()
-
-            elif self.sollution[0] == "D2":
-                img = self.get_face_rep_with_arrow(self.yellow_side,True,True)
-                self.panel = Label(self.root, image=img)
-                self.panel.image = img
-                self.panel.place(x=1000,y=450,in_=self.root)
-
-                temp1 = [self.green_side[6],self.green_side[7],self.green_side[8]]
-                temp2 = [self.red_side[6],self.red_side[7],self.red_side[8]]
-                self.green_side[6],self.green_side[7],self.green_side[8] = self.blue_side[6],self.blue_side[7],self.blue_side[8]
-                self.red_side[6],self.red_side[7],self.red_side[8] = self.orange_side[6],self.orange_side[7],self.orange_side[8]
-                self.blue_side[6],self.blue_side[7],self.blue_side[8] = temp1[0],temp1[1],temp1[2]
-                self.orange_side[6],self.orange_side[7],self.orange_side[8] = temp2[0],temp2[1],temp2[2]
-                temp3 = self.yellow_side
-                self.yellow_side = [temp3[8],temp3[7],temp3[6],temp3[5],temp3[4],temp3[3],temp3[2],temp3[1],temp3[0]]
-                self.update_grid_status()
-
-            elif self.sollution[0] == "D'":
-                img = self.get_face_rep_with_arrow(self.yellow_side,False,False)
-                self.panel = Label(self.root, image=img)
-                self.panel.image = img
-                self.panel.place(x=1000,y=450,in_=self.root)
-
-                temp1 = [self.green_side[6],self.green_side[7],self.green_side[8]]
-                self.green_side[6],self.green_side[7],self.green_side[8] = self.red_side[6],self.red_side[7],self.red_side[8]
-                self.red_side[6],self.red_side[7],self.red_side[8] = self.blue_side[6],self.blue_side[7],self.blue_side[8]
-                self.blue_side[6],self.blue_side[7],self.blue_side[8] = self.orange_side[6],self.orange_side[7],self.orange_side[8]
-                self.orange_side[6],self.orange_side[7],self.orange_side[8] = temp1[0],temp1[1],temp1[2]
-                temp2 = self.yellow_side
-                self.yellow_side = [temp2[2],temp2[5],temp2[8],temp2[1],temp2[4],temp2[7],temp2[0],temp2[3],temp2[6]]
-                self.update_grid_status()
+            state = CubeState.from_sides(self.white_side,self.red_side,self.green_side,self.yellow_side,self.orange_side,self.blue_side)
+            self.white_side,self.red_side,self.green_side,self.yellow_side,self.orange_side,self.blue_side = state.apply(move).sides()
+            self.update_grid_status()
 
         else:
             try:
@@ -552,9 +344,26 @@ class gui:
             except:
                 pass
 
+    def scan_probabilities(self):
+        if not all(face in self.probabilities for face in FACE_NAMES):
+            return None
+        return np.concatenate([self.probabilities[face] for face in FACE_NAMES])
+
     def solve_cube(self):
         str = self.white_str + self.red_str + self.green_str + self.yellow_str + self.orange_str + self.blue_str
-        self.sollution = kociemba.solve(str)
+        # one or two misread stickers are replaced by their likeliest consistent colour
+        str, problems, changes = validate_or_correct(str, self.scan_probabilities)
+        if problems:
+            # point at the misread face so it can be rescanned
+            messagebox.showerror("Invalid cube", "\n".join(problem.message for problem in problems))
+            return
+        if changes is not None:
+            for face, face_string, side in split_faces(str):
+                setattr(self, face.lower() + "_str", face_string)
+                setattr(self, face.lower() + "_side", side)
+            self.update_grid_status()
+            messagebox.showinfo("Corrected stickers", "Corrected misread stickers: " + describe_changes(changes))
+        self.sollution = solution_cache.solve(str)
         self.sollution = self.sollution.split(" ")
         self.solve_status = True
         print(self.sollution)
@@ -562,12 +371,18 @@ class gui:
         self.next.place(x=770,y=510,in_=self.root)
 
     def __init__(self):
+        load_color_model()
         self.root = Tk()
         self.root.title("Rubik's Cube Solver")
         self.root.geometry("1280x720")
         self.root.resizable(False, False)
         self.root.protocol("WM_DELETE_WINDOW",self.on_closing)
         self.cap = cv2.VideoCapture(0)
+        self.tracker = GridTracker()
+        self.stabilizer = FaceStabilizer()
+        # vote shares of each scanned face, for correcting misread stickers
+        self.probabilities = {}
+        self.worker = FrameWorker(self.cap, self.tracker, self.stabilizer)
         self.app = Frame(self.root, bg="white")
         self.app.place(x=738,y=20,in_=self.root)
         self.lmain = Label(self.app)
@@ -611,23 +426,24 @@ class gui:
         # self.next.place(x=770,y=510,in_=self.root)
 
     def video_stream(self):
-        _,self.frame1 = self.cap.read()
-        frame,self.grid = detect_grid(self.frame1)
-        if len(self.grid) == 9:
-            self.face = self.grid
-        frame  = cv2.resize(frame,(512,384))
-        cv2image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        img = Image.fromarray(cv2image)
-        imgtk = ImageTk.PhotoImage(img)
-        self.lmain.imgtk = imgtk
-        self.lmain.configure(image=imgtk)
+        # capture and detection run on self.worker; only display work stays on the Tk thread
+        latest = self.worker.latest()
+        if latest is not None:
+            img,self.grid = latest
+            if len(self.grid) == 9:
+                self.face = self.grid
+            imgtk = ImageTk.PhotoImage(img)
+            self.lmain.imgtk = imgtk
+            self.lmain.configure(image=imgtk)
         self.lmain.after(30, self.video_stream)
     
     def on_closing(self):
+        self.worker.stop()
         self.cap.release()
         self.root.destroy()
    
     def run(self):
+        self.worker.start()
         self.video_stream()
         self.root.mainloop()
       
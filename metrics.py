@@ -0,0 +1,108 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+# upper bounds in seconds, from sub-millisecond stages up to slow solves
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+enabled = os.environ.get("CUBE_METRICS", "0") not in ("", "0", "false")
+_histograms = {}
+_lock = threading.Lock()
+_disabled = nullcontext()
+
+
+class Histogram:
+    """Prometheus-style cumulative-bucket latency histogram"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.sum += seconds
+            self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th observation (inf past the last bucket)"""
+        with self.lock:
+            rank, seen = q * self.count, 0
+            for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+                seen += n
+                if seen >= rank and seen:
+                    return bound
+        return 0.0
+
+
+class _Timer:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.stage, time.perf_counter() - self.start)
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def timer(stage):
+    """Context manager timing one stage; a shared no-op when metrics are disabled"""
+    return _Timer(stage) if enabled else _disabled
+
+
+def observe(stage, seconds):
+    """Record a duration measured elsewhere, e.g. in a solver worker process"""
+    if not enabled:
+        return
+    histogram = _histograms.get(stage)
+    if histogram is None:
+        with _lock:
+            histogram = _histograms.setdefault(stage, Histogram())
+    histogram.observe(seconds)
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+def snapshot():
+    """Per-stage count, mean and approximate p50/p95/p99 in milliseconds"""
+    with _lock:
+        histograms = sorted(_histograms.items())
+    return {stage: {"count": h.count, "mean_ms": 1000 * h.sum / h.count if h.count else 0.0,
+                    "p50_ms": 1000 * h.quantile(0.5), "p95_ms": 1000 * h.quantile(0.95),
+                    "p99_ms": 1000 * h.quantile(0.99)}
+            for stage, h in histograms}
+
+
+def render_prometheus(name="cube_stage_seconds"):
+    """All histograms in the Prometheus text exposition format"""
+    lines = [f"# HELP {name} Time spent in each processing stage.", f"# TYPE {name} histogram"]
+    with _lock:
+        histograms = sorted(_histograms.items())
+    for stage, h in histograms:
+        with h.lock:
+            counts, total, count = list(h.counts), h.sum, h.count
+        cumulative = 0
+        for bound, n in zip(h.buckets + (float("inf"),), counts):
+            cumulative += n
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+        lines.append(f'{name}_sum{{stage="{stage}"}} {total}')
+        lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,145 @@
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def new_token():
+    return secrets.token_urlsafe(16)
+
+
+class MemoryStore:
+    """Session dicts in a bounded LRU that drops sessions idle for `ttl` seconds
+
+    Only visible to the current process; use SQLiteStore or RedisStore when
+    the API runs with more than one worker.
+    """
+
+    def __init__(self, ttl=3600, maxsize=10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, token):
+        with self.lock:
+            entry = self.sessions.get(token)
+            if entry is None:
+                return None
+            expires, data = entry
+            if expires < time.monotonic():
+                del self.sessions[token]
+                return None
+            return json.loads(data)
+
+    def put(self, token, data):
+        # stored as JSON so callers never share mutable state through the store
+        with self.lock:
+            self.sessions[token] = (time.monotonic() + self.ttl, json.dumps(data))
+            self.sessions.move_to_end(token)
+            self._evict()
+
+    def delete(self, token):
+        with self.lock:
+            self.sessions.pop(token, None)
+
+    def _evict(self):
+        now = time.monotonic()
+        # entries are in last-use order, so expired ones are at the front
+        while self.sessions:
+            token, (expires, _) = next(iter(self.sessions.items()))
+            if expires >= now and len(self.sessions) <= self.maxsize:
+                break
+            del self.sessions[token]
+
+
+class SQLiteStore:
+    """Session dicts in an SQLite file shared by every worker on the host
+
+    Expired rows are purged at most every `purge_interval` seconds, through
+    an index on the expiry time; get() ignores them in between.
+    """
+
+    def __init__(self, path, ttl=3600, purge_interval=60):
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self.next_purge = 0.0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS sessions (token TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)")
+        self.db.commit()
+
+    def get(self, token):
+        with self.lock:
+            row = self.db.execute("SELECT data FROM sessions WHERE token = ? AND expires >= ?",
+                                  (token, time.time())).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, token, data):
+        with self.lock:
+            now = time.time()
+            self.db.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+                            (token, json.dumps(data), now + self.ttl))
+            if now >= self.next_purge:
+                self.db.execute("DELETE FROM sessions WHERE expires < ?", (now,))
+                self.next_purge = now + self.purge_interval
+            self.db.commit()
+
+    def delete(self, token):
+        with self.lock:
+            self.db.execute("DELETE FROM sessions WHERE token = ?", (token,))
+            self.db.commit()
+
+
+class RedisStore:
+    """Session dicts in Redis (or any server speaking its protocol), expired by the server"""
+
+    def __init__(self, url, ttl=3600, prefix="cube-session:"):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("RedisStore needs the redis package: pip install redis")
+        self.ttl = ttl
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, token):
+        data = self.client.get(self.prefix + token)
+        return None if data is None else json.loads(data)
+
+    def put(self, token, data):
+        self.client.set(self.prefix + token, json.dumps(data), ex=int(self.ttl))
+
+    def delete(self, token):
+        self.client.delete(self.prefix + token)
+
+
+def open_store(url=None, ttl=3600):
+    """Store for `url`: "memory", "sqlite:///path/to/sessions.db" or "redis://host:6379/0" """
+    url = url or "memory"
+    if url == "memory":
+        return MemoryStore(ttl=ttl)
+    if url.startswith("sqlite:///"):
+        return SQLiteStore(url[len("sqlite:///"):], ttl=ttl)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStore(url, ttl=ttl)
+    raise ValueError(f"Unknown session store {url!r}")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """Shared store for this process, chosen by CUBE_SESSION_STORE and CUBE_SESSION_TTL"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = open_store(os.environ.get("CUBE_SESSION_STORE"),
+                                ttl=float(os.environ.get("CUBE_SESSION_TTL", 3600)))
+        return _store
@@ -0,0 +1,155 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import kociemba
+import numpy as np
+
+import metrics
+from cube_state import CENTERS, COLOR_IDS, FACE_LETTERS, FACE_ORDER, ORIENTATIONS
+
+_LETTER_BYTES = np.frombuffer(FACE_LETTERS.encode(), dtype=np.uint8)
+_STANDARD_CENTERS = np.array([COLOR_IDS[f] for f in FACE_ORDER])
+# face letter each orientation's faces came from, used to map solutions back
+_SOURCE_FACES = [{FACE_ORDER[f]: FACE_ORDER[perm[c] // 9] for f, c in enumerate(CENTERS)}
+                 for perm in ORIENTATIONS]
+
+
+def canonicalize(cube_string):
+    """Smallest equivalent facelet string over the 24 whole-cube rotations
+
+    Each rotated state is relabelled so its centres read URFDLB again, which is
+    what lets it be solved directly.  Returns (key, orientation index), or
+    (None, None) when the string is not a 54-facelet state with distinct centres.
+    """
+    if len(cube_string) != 54:
+        return None, None
+    try:
+        facelets = np.array([COLOR_IDS[c] for c in cube_string], dtype=np.intp)
+    except KeyError:
+        return None, None
+    if len(set(facelets[CENTERS])) != 6:
+        return None, None
+    rotated = facelets[ORIENTATIONS]
+    relabel = np.empty((len(ORIENTATIONS), 6), dtype=np.intp)
+    np.put_along_axis(relabel, rotated[:, CENTERS], _STANDARD_CENTERS[None, :], axis=1)
+    keys = _LETTER_BYTES[np.take_along_axis(relabel, rotated, axis=1)]
+    best = min(range(len(keys)), key=lambda k: keys[k].tobytes())
+    return keys[best].tobytes().decode(), best
+
+
+def restore_solution(solution, orientation):
+    """Rename the faces of a solution found for a rotated state back to the original frame"""
+    faces = _SOURCE_FACES[orientation]
+    return " ".join(faces[move[0]] + move[1:] for move in solution.split())
+
+
+class SolutionCache:
+    """Bounded LRU of Kociemba solutions keyed on the canonical cube state
+
+    With `path`, solutions are also stored in an SQLite file so they survive
+    restarts and are shared by every process pointing at the same file.  Each
+    process opens its own connection on first use, since an SQLite connection
+    must not be carried across fork() (gunicorn's preload_app, the solver
+    pool's fork server).
+    """
+
+    def __init__(self, maxsize=4096, path=None):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.path = path
+        self._db = None
+        self._db_pid = None
+        self._inherited = []
+
+    def _connection(self):
+        """This process's connection to the SQLite file, or None without one; call with the lock held"""
+        if not self.path:
+            return None
+        if self._db_pid != os.getpid():
+            if self._db is not None:
+                # inherited from the parent: keep it referenced so it is never used or closed here
+                self._inherited.append(self._db)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS solutions (state TEXT PRIMARY KEY, solution TEXT NOT NULL)")
+            self._db.commit()
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _get(self, key):
+        with self.lock:
+            solution = self.entries.get(key)
+            if solution is not None:
+                self.entries.move_to_end(key)
+                return solution
+            db = self._connection()
+            if db is not None:
+                row = db.execute("SELECT solution FROM solutions WHERE state = ?", (key,)).fetchone()
+                if row is not None:
+                    self._remember(key, row[0])
+                    return row[0]
+        return None
+
+    def _put(self, key, solution):
+        with self.lock:
+            self._remember(key, solution)
+            db = self._connection()
+            if db is not None:
+                db.execute("INSERT OR REPLACE INTO solutions VALUES (?, ?)", (key, solution))
+                db.commit()
+
+    def _remember(self, key, solution):
+        self.entries[key] = solution
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def get(self, cube_string):
+        """Cached solution for `cube_string`, or None"""
+        key, orientation = canonicalize(cube_string)
+        if key is None:
+            return None
+        solution = self._get(key)
+        if solution is None:
+            return None
+        return restore_solution(solution, orientation)
+
+    def put(self, cube_string, solution):
+        key, orientation = canonicalize(cube_string)
+        if key is None:
+            return
+        # store the solution for the canonical state; the inverse orientation maps it there
+        inverse = {src: dst for dst, src in _SOURCE_FACES[orientation].items()}
+        self._put(key, " ".join(inverse[move[0]] + move[1:] for move in solution.split()))
+
+    def solve(self, cube_string, solver=kociemba.solve):
+        """Solve through the cache; same result format as kociemba.solve"""
+        key, orientation = canonicalize(cube_string)
+        if key is None:
+            return solver(cube_string)
+        solution = self._get(key)
+        if solution is None:
+            self.misses += 1
+            with metrics.timer("solve"):
+                solution = solver(key)
+            self._put(key, solution)
+        else:
+            self.hits += 1
+        return restore_solution(solution, orientation)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+default_cache = SolutionCache(maxsize=int(os.environ.get("CUBE_SOLUTION_CACHE_SIZE", 4096)),
+                              path=os.environ.get("CUBE_SOLUTION_DB"))
+
+
+def solve(cube_string):
+    """Drop-in replacement for kociemba.solve backed by the shared solution cache"""
+    return default_cache.solve(cube_string)
@@ -0,0 +1,177 @@
+"""Solve a file of cube strings on every core.
+
+Reads one 54-character Kociemba facelet string per line from a file or stdin
+and writes one result per line, as JSONL or CSV, in input order.  Results are
+flushed as they finish, so an interrupted run picks up where it stopped when
+started again with the same output file.
+
+    python solve_batch.py scrambles.txt -o solutions.jsonl
+    python solve_batch.py scrambles.txt -o solutions.csv --solver two_phase --time-budget 1
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+
+import kociemba
+
+import two_phase
+from cube_validator import check
+from kociemba_tables import warm_up
+
+FIELDS = ["index", "cube", "solution", "moves", "solve_time", "error"]
+# block size for scanning result files when resuming
+CHUNK_SIZE = 1 << 20
+
+_options = {}
+
+
+def _init_worker(options):
+    _options.update(options)
+    if options["solver"] == "two_phase":
+        two_phase.load_tables()
+    else:
+        warm_up()
+
+
+def _solve(index, cube_string):
+    start = time.perf_counter()
+    result = {"index": index, "cube": cube_string, "solution": None, "moves": None, "error": None}
+    try:
+        check(cube_string)
+        if _options["solver"] == "two_phase":
+            solution = two_phase.solve(cube_string, max_depth=_options["max_depth"],
+                                       time_budget=_options["time_budget"], optimal=_options["optimal"])
+        else:
+            solution = kociemba.solve(cube_string)
+        result["solution"] = solution
+        result["moves"] = len(solution.split())
+    except ValueError as e:
+        result["error"] = str(e)
+    result["solve_time"] = round(time.perf_counter() - start, 6)
+    return result
+
+
+def read_cubes(lines):
+    """(index, cube string) for each non-blank line"""
+    index = 0
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield index, line
+            index += 1
+
+
+def finished_count(path, fmt):
+    """Results already in `path`, dropping a partly written last line
+
+    Only the tail is read to find the last complete line, and lines are
+    counted a block at a time, so resuming a huge file needs little memory.
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        while end > 0:
+            block = max(end - CHUNK_SIZE, 0)
+            f.seek(block)
+            newline = f.read(end - block).rfind(b"\n")
+            if newline >= 0:
+                end = block + newline + 1
+                break
+            end = block
+        if end < f.seek(0, os.SEEK_END):
+            f.truncate(end)
+        f.seek(0)
+        lines = 0
+        while f.tell() < end:
+            lines += f.read(min(CHUNK_SIZE, end - f.tell())).count(b"\n")
+    # the CSV header is not a result
+    return max(lines - 1, 0) if fmt == "csv" else lines
+
+
+class ResultWriter:
+    def __init__(self, stream, fmt, header):
+        self.stream = stream
+        self.fmt = fmt
+        if fmt == "csv":
+            self.csv = csv.DictWriter(stream, fieldnames=FIELDS, lineterminator="\n")
+            if header:
+                self.csv.writeheader()
+
+    def write(self, result):
+        if self.fmt == "csv":
+            self.csv.writerow(result)
+        else:
+            self.stream.write(json.dumps(result) + "\n")
+        self.stream.flush()
+
+
+def solve_all(cubes, writer, workers, options, window=None):
+    """Solve `cubes` in a process pool with at most `window` solves in flight
+
+    Results are written in input order, and the bounded window keeps memory
+    constant however long the input is.  Returns (solved, failed) counts.
+    """
+    window = window or 4 * workers
+    pending = deque()
+    counts = [0, 0]
+
+    def write_next():
+        result = pending.popleft().get()
+        writer.write(result)
+        counts[result["error"] is not None] += 1
+
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(options,)) as pool:
+        for index, cube_string in cubes:
+            pending.append(pool.apply_async(_solve, (index, cube_string)))
+            if len(pending) >= window:
+                write_next()
+        while pending:
+            write_next()
+    return tuple(counts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Solve a file of 54-character cube strings in parallel.")
+    parser.add_argument("input", nargs="?", default="-", help="file with one cube per line (default: stdin)")
+    parser.add_argument("-o", "--output", default="-", help="result file; resumed if it already exists (default: stdout)")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="output format (default: from the output extension)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="solver processes (default: all cores)")
+    parser.add_argument("--solver", choices=["kociemba", "two_phase"], default="kociemba")
+    parser.add_argument("--max-depth", type=int, help="two_phase: stop at the first solution this short")
+    parser.add_argument("--time-budget", type=float, help="two_phase: seconds to spend shortening each solution")
+    parser.add_argument("--optimal", action="store_true", help="two_phase: search for the shortest solution")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("csv" if args.output.endswith(".csv") else "jsonl")
+    options = {"solver": args.solver, "max_depth": args.max_depth,
+               "time_budget": args.time_budget, "optimal": args.optimal}
+    # load the tables once here so forked workers start with them
+    _init_worker(options)
+
+    done = 0 if args.output == "-" else finished_count(args.output, fmt)
+    source = sys.stdin if args.input == "-" else open(args.input)
+    output = sys.stdout if args.output == "-" else open(args.output, "a", newline="")
+    start = time.perf_counter()
+    try:
+        cubes = (item for item in read_cubes(source) if item[0] >= done)
+        writer = ResultWriter(output, fmt, header=output is sys.stdout or output.tell() == 0)
+        solved, failed = solve_all(cubes, writer, args.workers, options)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+    elapsed = time.perf_counter() - start
+    count = solved + failed
+    print(f"solved {solved} cubes, {failed} failed, in {elapsed:.1f}s ({count / elapsed if elapsed else 0:.1f}/s), "
+          f"skipped {done} already done", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
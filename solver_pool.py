@@ -0,0 +1,277 @@
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict, deque
+from multiprocessing.connection import wait
+
+import kociemba
+
+import metrics
+import solution_cache
+import two_phase
+from kociemba_tables import warm_up
+
+SOLVERS = ("kociemba", "two_phase")
+# the native solver returns its first solution this short; 22 moves takes about
+# 10 ms, while 20 can take longer than any timeout
+MAX_DEPTH = 22
+# share of a job's timeout the native solver may search before giving up cleanly
+BUDGET_SHARE = 0.8
+
+
+class QueueFull(Exception):
+    """Raised when the pool already holds `max_queue` pending solves"""
+
+
+def _worker_main(conn, solver):
+    # no-op when the worker was forked from a fork server that preloaded this solver's tables
+    if solver == "two_phase":
+        two_phase.load_tables()
+    else:
+        warm_up()
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        cube_string, max_depth, time_budget = request
+        try:
+            if solver == "two_phase":
+                conn.send((True, two_phase.solve(cube_string, max_depth=max_depth, time_budget=time_budget)))
+            else:
+                conn.send((True, kociemba.solve(cube_string)))
+        except Exception as e:
+            conn.send((False, str(e)))
+
+
+class _Worker:
+    def __init__(self, context, solver):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child, solver), daemon=True)
+        self.process.start()
+        child.close()
+        self.job = None
+
+    def kill(self):
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+
+class SolveJob:
+    def __init__(self, cube_string, timeout):
+        self.id = uuid.uuid4().hex
+        self.cube_string = cube_string
+        self.timeout = timeout
+        self.state = "queued"
+        self.solution = None
+        self.error = None
+        self.submitted = time.monotonic()
+        self.started = None
+        self.finished = None
+        self.cancel_requested = False
+
+    def to_dict(self):
+        info = {"job_id": self.id, "state": self.state}
+        if self.solution is not None:
+            info["solution"] = self.solution
+        if self.error is not None:
+            info["error"] = self.error
+        if self.finished is not None:
+            info["solve_time"] = self.finished - (self.started or self.submitted)
+        return info
+
+
+def _worker_context(solver="kociemba"):
+    """Fork workers from a warm fork server where available so they share the tables
+
+    The preload only takes effect if the fork server is not running yet,
+    i.e. for the first pool a process starts.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        preload = ["kociemba_preload", "solver_pool"]
+        if solver == "two_phase":
+            preload.insert(1, "two_phase_preload")
+        context.set_forkserver_preload(preload)
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+class SolverPool:
+    """Kociemba solves in warm worker processes with per-solve timeouts
+
+    Solves are submitted asynchronously and polled by job id.  A solve that
+    runs past its timeout or is cancelled kills its worker, which is replaced
+    straight away, so one bad state cannot block the others.  With
+    solver="two_phase" each solve instead returns the first solution of at
+    most `max_depth` moves, and fails cleanly if none turns up within
+    BUDGET_SHARE of its timeout.
+    """
+
+    def __init__(self, workers=2, timeout=10.0, max_queue=32, keep_finished=1024, solver="kociemba",
+                 max_depth=MAX_DEPTH):
+        if solver not in SOLVERS:
+            raise ValueError(f"Unknown solver {solver!r}, expected one of {SOLVERS}")
+        self.solver = solver
+        self.max_depth = max_depth
+        self.timeout = timeout
+        self.max_queue = max_queue
+        self.keep_finished = keep_finished
+        self.context = _worker_context(solver)
+        self.lock = threading.Lock()
+        self.pending = deque()
+        self.jobs = {}
+        self.finished = OrderedDict()
+        self.workers = [_Worker(self.context, solver) for _ in range(workers)]
+        self._wake_r, self._wake_w = self.context.Pipe(duplex=False)
+        self.closed = False
+        self.dispatcher = threading.Thread(target=self._run, daemon=True)
+        self.dispatcher.start()
+
+    def submit(self, cube_string, timeout=None):
+        """Queue a solve and return its job id; cached states finish immediately"""
+        job = SolveJob(cube_string, timeout or self.timeout)
+        cached = solution_cache.default_cache.get(cube_string)
+        with self.lock:
+            if cached is not None:
+                job.state = "done"
+                job.solution = cached
+                job.finished = time.monotonic()
+                self._retire(job)
+                return job.id
+            if len(self.pending) >= self.max_queue:
+                raise QueueFull(f"{len(self.pending)} solves already queued")
+            self.jobs[job.id] = job
+            self.pending.append(job)
+        self._wake()
+        return job.id
+
+    def status(self, job_id):
+        """Job state as a dict, or None for an unknown (or long expired) job id"""
+        with self.lock:
+            job = self.jobs.get(job_id) or self.finished.get(job_id)
+            return None if job is None else job.to_dict()
+
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return False
+            if job.state == "queued":
+                self.pending.remove(job)
+                self._finish(job, "cancelled")
+            else:
+                job.cancel_requested = True
+        self._wake()
+        return True
+
+    def queue_depth(self):
+        with self.lock:
+            return len(self.pending)
+
+    def shutdown(self):
+        self.closed = True
+        self._wake()
+        self.dispatcher.join(timeout=1)
+        for worker in self.workers:
+            worker.kill()
+
+    def _wake(self):
+        self._wake_w.send(None)
+
+    def _finish(self, job, state, solution=None, error=None):
+        job.state = state
+        job.solution = solution
+        job.error = error
+        job.finished = time.monotonic()
+        del self.jobs[job.id]
+        self._retire(job)
+
+    def _retire(self, job):
+        self.finished[job.id] = job
+        while len(self.finished) > self.keep_finished:
+            self.finished.popitem(last=False)
+
+    def _replace(self, worker):
+        worker.kill()
+        self.workers[self.workers.index(worker)] = _Worker(self.context, self.solver)
+
+    def _run(self):
+        while not self.closed:
+            try:
+                self._dispatch()
+            except Exception:
+                # a dead dispatcher would leave every job queued or running forever
+                traceback.print_exc()
+                time.sleep(0.1)
+
+    def _start(self, worker, job):
+        """Hand `job` to an idle worker; a worker that died while idle is replaced and the job requeued"""
+        try:
+            worker.conn.send((job.cube_string, self.max_depth, job.timeout * BUDGET_SHARE))
+        except OSError:
+            self.pending.appendleft(job)
+            self._replace(worker)
+            return
+        job.state = "running"
+        job.started = time.monotonic()
+        worker.job = job
+
+    def _dispatch(self):
+        """Start queued jobs on idle workers, then collect results and enforce timeouts"""
+        with self.lock:
+            for worker in list(self.workers):
+                if worker.job is None and self.pending:
+                    self._start(worker, self.pending.popleft())
+            busy = [w for w in self.workers if w.job is not None]
+        ready = wait([w.conn for w in busy] + [self._wake_r], timeout=0.1)
+        if self._wake_r in ready:
+            while self._wake_r.poll():
+                self._wake_r.recv()
+        now = time.monotonic()
+        with self.lock:
+            for worker in busy:
+                job = worker.job
+                if worker.conn in ready:
+                    worker.job = None
+                    try:
+                        ok, result = worker.conn.recv()
+                    except (EOFError, OSError):
+                        self._replace(worker)
+                        self._finish(job, "failed", error="Solver process exited")
+                        continue
+                    if ok:
+                        self._finish(job, "done", solution=result)
+                        metrics.observe("solve", job.finished - job.started)
+                        metrics.observe("solve_wait", job.started - job.submitted)
+                        solution_cache.default_cache.put(job.cube_string, result)
+                    else:
+                        self._finish(job, "failed", error=result)
+                elif job.cancel_requested or now - job.started > job.timeout:
+                    worker.job = None
+                    self._replace(worker)
+                    self._finish(job, "cancelled" if job.cancel_requested else "timeout",
+                                 error=None if job.cancel_requested else f"No solution within {job.timeout:g}s")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_solver_pool():
+    """Shared pool for this process, started on first use and sized from the environment"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SolverPool(workers=int(os.environ.get("CUBE_SOLVER_WORKERS", 2)),
+                               timeout=float(os.environ.get("CUBE_SOLVER_TIMEOUT", 10)),
+                               max_queue=int(os.environ.get("CUBE_SOLVER_QUEUE", 32)),
+                               solver=os.environ.get("CUBE_SOLVER", "kociemba"),
+                               max_depth=int(os.environ.get("CUBE_SOLVER_MAX_DEPTH", MAX_DEPTH)))
+        return _pool
@@ -2,20 +2,21 @@ import streamlit as st
 import cv2
 import numpy as np
 from PIL import Image
-import kociemba
-import pickle
+import solution_cache
+import metrics
+from cube_validator import FACE_NAMES, describe_changes, split_faces, validate_or_correct
+from kociemba_tables import warm_up
 import pandas as pd
-from image_processing import detect_grid, classifiy_grid
-import time
+from image_processing import detect_grid, classifiy_grid, load_color_model, sticker_probabilities, DETECT_WIDTH
 
 # Load the trained model
 @st.cache_resource
 def load_model():
+    warm_up()
     try:
-        loaded_model = pickle.load(open("model.sav", 'rb'))
-        return loaded_model
+        return load_color_model()
     except Exception as e:
-        st.error(f"Model file 'model.sav' not found! Error: {str(e)}")
+        st.error(f"Model file 'model.npz' not found! Error: {str(e)}")
         return None
 
 class RubiksCubeSolver:
@@ -42,9 +43,14 @@ class RubiksCubeSolver:
         
         self.solve_status = False
         self.scanned_faces = set()  # Track which faces have been scanned
+        self.colors = {}  # per-face BGR sticker colours, classified again only to correct misreads
     
-    def scan_face(self, face_name, face_data, side_data):
+    def scan_face(self, face_name, face_data, side_data, colors=None):
         """Scan a face and update the corresponding string and side data"""
+        if colors is None:
+            self.colors.pop(face_name, None)
+        else:
+            self.colors[face_name] = colors
         if face_name == "Green":
             self.green_str = face_data
             self.green_side = side_data
@@ -70,12 +76,28 @@ class RubiksCubeSolver:
             self.yellow_side = side_data
             self.scanned_faces.add("Yellow")
     
+    def scan_probabilities(self):
+        """(54, 6) sticker colour probabilities of the scanned faces, or None without every face's colours"""
+        if not all(face in self.colors for face in FACE_NAMES):
+            return None
+        return sticker_probabilities([self.colors[face] for face in FACE_NAMES]).reshape(54, -1)
+    
     def solve_cube(self):
         """Solve the cube using Kociemba algorithm - matching backend logic"""
         try:
             # Create cube string in the same order as backend
             cube_string = self.white_str + self.red_str + self.green_str + self.yellow_str + self.orange_str + self.blue_str
-            self.solution = kociemba.solve(cube_string).split(" ")
+            # one or two misread stickers are replaced by their likeliest consistent colour
+            cube_string, problems, changes = validate_or_correct(cube_string, self.scan_probabilities)
+            if changes is not None:
+                for face, face_string, side in split_faces(cube_string):
+                    self.scan_face(face, face_string, side, self.colors[face])
+                st.warning("Corrected misread stickers: " + describe_changes(changes))
+            if problems:
+                st.error("Cube state is inconsistent, rescan the faces named below:\n\n"
+                         + "\n".join(f"- {problem.message}" for problem in problems))
+                return False
+            self.solution = solution_cache.solve(cube_string).split(" ")
             self.solve_status = True
             return True
         except Exception as e:
@@ -99,6 +121,7 @@ class RubiksCubeSolver:
         self.face = []
         self.solution = []
         self.scanned_faces.clear()
+        self.colors = {}
         self.green_str = "FFFFFFFFF"
         self.white_str = "UUUUUUUUU"
         self.red_str = "RRRRRRRRR"
@@ -204,6 +227,18 @@ def create_face_status_display(solver):
     html += "</div>"
     return html
 
+def create_metrics_panel():
+    """Sidebar debug panel with per-stage latency histograms"""
+    with st.sidebar.expander("🛠️ Debug: stage latency"):
+        metrics.enable(st.checkbox("Record stage timings", value=metrics.enabled))
+        if st.button("Clear timings"):
+            metrics.reset()
+        stats = metrics.snapshot()
+        if stats:
+            st.dataframe(pd.DataFrame.from_dict(stats, orient="index").round(2))
+        else:
+            st.caption("No timings recorded yet.")
+
 def main():
     st.set_page_config(
         page_title="Rubik's Cube Solver - Camera Mode",
@@ -312,12 +347,13 @@ def main():
         
         if camera_input is not None:
             # Convert to OpenCV format
-            image = Image.open(camera_input)
-            image_array = np.array(image)
-            image_cv = cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR)
+            with metrics.timer("decode"):
+                image = Image.open(camera_input)
+                image_array = np.array(image)
+                image_cv = cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR)
             
             # Process the image using backend functions
-            processed_image, grid = detect_grid(image_cv)
+            processed_image, grid = detect_grid(image_cv, detect_width=DETECT_WIDTH)
             
             # Display the processed image
             st.image(processed_image, caption="Live Camera Feed with Grid Detection", use_column_width=True)
@@ -352,7 +388,7 @@ def main():
                             st.success(f"🎯 {detected_face} face detected")
                             
                             if st.button(f"✅ Save {detected_face}", key="save_btn"):
-                                solver.scan_face(detected_face, face_string, predictions)
+                                solver.scan_face(detected_face, face_string, predictions, grid[:, :3])
                                 st.success(f"✅ {detected_face} saved! ({len(solver.scanned_faces)}/6)")
                                 
                                 # Auto-solve when all faces are scanned
@@ -435,6 +471,9 @@ def main():
     
     st.markdown("---")
     st.markdown("**🎉 That's it! Just show each face to the camera and get your solution!**")
+    
+    # drawn last so it includes this run's timings
+    create_metrics_panel()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
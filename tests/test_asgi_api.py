@@ -0,0 +1,47 @@
+"""Request validation of the ASGI endpoints"""
+import pytest
+
+pytest.importorskip("httpx")
+from starlette.testclient import TestClient
+
+import asgi_app
+from solver_pool import get_solver_pool
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(asgi_app.app) as client:
+        yield client
+    get_solver_pool().shutdown()
+
+
+def test_multipart_without_a_file_is_rejected(client):
+    response = client.post("/api/process-image", data={"stream": "1"}, files={"note": (None, "no image")})
+    assert response.status_code == 400
+    assert response.json()["success"] is False
+
+
+def test_json_without_image_is_rejected(client):
+    assert client.post("/api/process-image", json={"stream": True}).status_code == 400
+
+
+@pytest.mark.parametrize("body", ["[1, 2]", "\"face\"", "{not json"])
+def test_save_face_needs_a_json_object(client, body):
+    response = client.post("/api/save-face", content=body, headers={"content-type": "application/json"})
+    assert response.status_code == 400
+
+
+def test_save_face_runs_in_the_executor(client, monkeypatch):
+    calls = []
+    run = asgi_app.executor.run
+
+    async def recording_run(fn, *args, **kwargs):
+        calls.append(fn.__name__)
+        return await run(fn, *args, **kwargs)
+
+    monkeypatch.setattr(asgi_app.executor, "run", recording_run)
+    response = client.post("/api/save-face", json={"face_name": "Green", "face_string": "FFFFFFFFF",
+                                                   "predictions": [0] * 9})
+    assert response.status_code == 200
+    assert response.json()["scanned_faces"] == ["Green"]
+    assert calls == ["save_face_result"]
@@ -0,0 +1,102 @@
+"""/ws/frames served by a real uvicorn server, so the websockets protocol stack is exercised too"""
+import asyncio
+import json
+import socket
+import threading
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+websockets = pytest.importorskip("websockets")
+uvicorn = pytest.importorskip("uvicorn")
+
+import asgi_app
+from solver_pool import get_solver_pool
+
+
+@pytest.fixture(scope="module")
+def server_url():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(asgi_app.app, log_level="warning", ws="websockets"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 60
+    while not server.started:
+        assert thread.is_alive() and time.monotonic() < deadline, "uvicorn did not start"
+        time.sleep(0.05)
+    yield f"ws://127.0.0.1:{port}"
+    server.should_exit = True
+    thread.join(timeout=10)
+    get_solver_pool().shutdown()
+    sock.close()
+
+
+def frame_bytes():
+    image = np.full((240, 320, 3), 90, dtype=np.uint8)
+    return cv2.imencode(".jpg", image)[1].tobytes()
+
+
+def exchange(url, messages, replies):
+    async def run():
+        async with websockets.connect(url) as ws:
+            received = [json.loads(await ws.recv())]
+            for message in messages:
+                await ws.send(message)
+            while len(received) < replies:
+                received.append(await asyncio.wait_for(ws.recv(), timeout=30))
+            return received
+    return asyncio.run(run())
+
+
+def test_frames_are_analysed(server_url):
+    hello, detection = exchange(server_url + "/ws/frames", [frame_bytes()], 2)
+    assert hello["type"] == "session" and hello["session"]
+    detection = json.loads(detection)
+    assert detection["type"] == "detection"
+    assert detection["frame"] == 1
+    assert detection["dropped"] == 0
+    assert "status" in detection
+
+
+def test_undecodable_frame_reports_error(server_url):
+    _, detection = exchange(server_url + "/ws/frames", [b"not an image"], 2)
+    detection = json.loads(detection)
+    assert detection["success"] is False
+    assert "error" in detection
+
+
+def test_annotated_stream_sends_jpeg(server_url):
+    hello, detection, jpeg = exchange(server_url + "/ws/frames?annotate=1", [frame_bytes()], 3)
+    assert json.loads(detection)["type"] == "detection"
+    assert jpeg[:2] == b"\xff\xd8"
+
+
+def test_session_is_resumed(server_url):
+    hello, _ = exchange(server_url + "/ws/frames", [frame_bytes()], 2)
+    again, = exchange(server_url + "/ws/frames?session=" + hello["session"], [], 1)
+    assert again["session"] == hello["session"]
+
+
+def test_frames_keep_faces_saved_over_rest(server_url):
+    httpx = pytest.importorskip("httpx")
+    http_url = server_url.replace("ws://", "http://", 1)
+
+    async def run():
+        async with websockets.connect(server_url + "/ws/frames") as ws:
+            token = json.loads(await ws.recv())["session"]
+            headers = {"X-Session-Token": token}
+            await ws.send(frame_bytes())
+            await asyncio.wait_for(ws.recv(), timeout=30)
+            async with httpx.AsyncClient(base_url=http_url, headers=headers) as client:
+                saved = await client.post("/api/save-face", json={"face_name": "Green", "face_string": "FFFFFFFFF",
+                                                                  "predictions": [0] * 9})
+                assert saved.json()["scanned_faces"] == ["Green"]
+                await ws.send(frame_bytes())
+                await asyncio.wait_for(ws.recv(), timeout=30)
+                return (await client.get("/api/status")).json()
+
+    assert asyncio.run(run())["scanned_faces"] == ["Green"]
@@ -0,0 +1,28 @@
+import numpy as np
+
+from capture_data import SampleBuffer
+
+
+def fill(buffer, value):
+    buffer.add(np.full((9, 3), value, dtype=np.uint8))
+    return buffer.flush()
+
+
+def test_shards_continue_after_the_highest_one(tmp_path):
+    first = SampleBuffer(str(tmp_path), label=5, size=9)
+    paths = [fill(first, value) for value in (10, 20, 30)]
+    # a bad shard deleted from the middle
+    (tmp_path / "yellow-00001.npz").unlink()
+    again = SampleBuffer(str(tmp_path), label=5, size=9)
+    assert fill(again, 40).endswith("yellow-00003.npz")
+    with np.load(paths[2]) as shard:
+        assert (shard["colors"] == 30).all()
+
+
+def test_existing_shard_is_never_replaced(tmp_path):
+    buffer = SampleBuffer(str(tmp_path), label=0, size=9)
+    # another capture writes the next shard first
+    fill(SampleBuffer(str(tmp_path), label=0, size=9), 50)
+    assert fill(buffer, 60).endswith("green-00001.npz")
+    with np.load(tmp_path / "green-00000.npz") as shard:
+        assert (shard["colors"] == 50).all()
@@ -0,0 +1,93 @@
+import numpy as np
+
+from cube_state import CubeState
+from cube_validator import CLASS_LETTERS, InvalidCube, check, correct, validate, validate_or_correct
+from two_phase import CORNER_FACELETS, EDGE_FACELETS
+
+SCRAMBLED = CubeState().apply("R U2 F' L D2 B R' U F2 D L' B2 U' R2 F D' L2 B' U2 R").to_string()
+
+
+def moved(cube_string, facelets, values):
+    cube = list(cube_string)
+    for f, value in zip(facelets, values):
+        cube[f] = value
+    return "".join(cube)
+
+
+def messages(cube_string):
+    return [problem.message for problem in validate(cube_string)]
+
+
+def test_scrambled_cube_is_valid():
+    assert validate(SCRAMBLED) == []
+    check(SCRAMBLED)
+
+
+def test_twisted_corner():
+    corner = [int(f) for f in CORNER_FACELETS[0]]
+    colors = [SCRAMBLED[f] for f in corner]
+    assert messages(moved(SCRAMBLED, corner, colors[1:] + colors[:1])) == ["A corner is twisted in place"]
+
+
+def test_flipped_edge():
+    edge = [int(f) for f in EDGE_FACELETS[0]]
+    colors = [SCRAMBLED[f] for f in edge]
+    assert messages(moved(SCRAMBLED, edge, colors[::-1])) == ["An edge is flipped in place"]
+
+
+def test_swapped_edges_break_parity():
+    first, second = ([int(f) for f in edge] for edge in EDGE_FACELETS[:2])
+    swapped = moved(SCRAMBLED, first + second, [SCRAMBLED[f] for f in second + first])
+    assert messages(swapped) == ["Two pieces are swapped"]
+
+
+def test_misread_sticker_is_located():
+    f = int(EDGE_FACELETS[3][0])
+    wrong = next(c for c in "URFDLB" if c != SCRAMBLED[f])
+    problems = validate(moved(SCRAMBLED, [f], [wrong]))
+    assert problems
+    assert any(("White Red Green Yellow Orange Blue".split()[f // 9], f % 9) in problem.stickers
+               for problem in problems)
+    try:
+        check(moved(SCRAMBLED, [f], [wrong]))
+    except InvalidCube as e:
+        assert e.problems
+    else:
+        raise AssertionError("check() accepted an invalid cube")
+
+
+def probabilities_for(cube_string, misread):
+    """Confident one-hot readings, except `misread` stickers which lean towards a wrong colour"""
+    probabilities = np.full((54, 6), 0.01)
+    for f, c in enumerate(cube_string):
+        probabilities[f, CLASS_LETTERS.index(c)] = 0.95
+    for f, wrong in misread.items():
+        probabilities[f, CLASS_LETTERS.index(wrong)] = 0.6
+        probabilities[f, CLASS_LETTERS.index(cube_string[f])] = 0.35
+    return probabilities
+
+
+def test_one_misread_sticker_is_corrected():
+    f = int(CORNER_FACELETS[2][1])
+    wrong = next(c for c in "URFDLB" if c != SCRAMBLED[f])
+    probabilities = probabilities_for(SCRAMBLED, {f: wrong})
+    cube_string, changes = correct(probabilities)
+    assert cube_string == SCRAMBLED
+    assert len(changes) == 1
+    assert changes[0]["index"] == f % 9
+
+
+def test_validate_or_correct_only_computes_probabilities_when_invalid():
+    calls = []
+
+    def probabilities():
+        calls.append(1)
+        return None
+
+    assert validate_or_correct(SCRAMBLED, probabilities) == (SCRAMBLED, [], None)
+    assert calls == []
+    f = int(EDGE_FACELETS[5][1])
+    wrong = next(c for c in "URFDLB" if c != SCRAMBLED[f])
+    misread = moved(SCRAMBLED, [f], [wrong])
+    cube_string, problems, changes = validate_or_correct(misread, lambda: probabilities_for(SCRAMBLED, {f: wrong}))
+    assert (cube_string, problems, len(changes)) == (SCRAMBLED, [], 1)
@@ -0,0 +1,65 @@
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def enabled():
+    was = metrics.enabled
+    metrics.enable()
+    metrics.reset()
+    yield
+    metrics.reset()
+    metrics.enable(was)
+
+
+def buckets(text, stage):
+    """{le: cumulative count} of one stage from the Prometheus text"""
+    prefix = f'cube_stage_seconds_bucket{{stage="{stage}",le="'
+    return {line[len(prefix):line.index('"}')]: int(line.rsplit(" ", 1)[1])
+            for line in text.splitlines() if line.startswith(prefix)}
+
+
+def test_bucket_bounds_are_inclusive():
+    h = metrics.Histogram(buckets=(0.001, 0.01))
+    for seconds in (0.001, 0.0011, 0.01, 0.5):
+        h.observe(seconds)
+    # a value equal to a bound belongs to that bucket, like Prometheus' le
+    assert h.counts == [1, 2, 1]
+    assert h.quantile(0.25) == 0.001
+    assert h.quantile(0.75) == 0.01
+    assert h.quantile(1.0) == float("inf")
+
+
+def test_render_prometheus(enabled):
+    metrics.observe("decode", 0.001)
+    metrics.observe("decode", 0.003)
+    metrics.observe("decode", 20.0)
+    text = metrics.render_prometheus()
+    assert text.startswith("# HELP cube_stage_seconds ")
+    assert "# TYPE cube_stage_seconds histogram\n" in text
+    counts = buckets(text, "decode")
+    assert list(counts) == [repr(b) for b in metrics.BUCKETS] + ["+Inf"]
+    assert counts["0.0005"] == 0
+    assert counts["0.001"] == 1
+    assert counts["0.005"] == 2
+    assert counts["10.0"] == 2
+    assert counts["+Inf"] == 3
+    assert 'cube_stage_seconds_sum{stage="decode"} 20.004' in text
+    assert text.endswith('cube_stage_seconds_count{stage="decode"} 3\n')
+
+
+def test_timer_records_the_stage(enabled):
+    with metrics.timer("encode"):
+        pass
+    assert metrics.snapshot()["encode"]["count"] == 1
+
+
+def test_timer_is_a_no_op_when_disabled(enabled):
+    metrics.enable(False)
+    with metrics.timer("encode"):
+        pass
+    metrics.observe("solve", 1.0)
+    assert metrics.timer("encode") is metrics.timer("decode")
+    assert metrics.snapshot() == {}
+    assert metrics.render_prometheus().count("\n") == 2
@@ -0,0 +1,66 @@
+"""Session write-back of the Flask API when requests in one session overlap"""
+import numpy as np
+import pytest
+
+import app
+from session_store import MemoryStore
+
+GREEN = {"face_name": "Green", "face_string": "FFFFFFFFF", "predictions": [0] * 9}
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = MemoryStore()
+    writes = []
+    put = store.put
+
+    def recording_put(token, data):
+        writes.append(token)
+        put(token, data)
+
+    monkeypatch.setattr(store, "put", recording_put)
+    store.writes = writes
+    monkeypatch.setattr(app, "get_session_store", lambda: store)
+    return store
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+def new_session(client):
+    return client.get("/api/status").headers[app.SESSION_HEADER]
+
+
+def scanned(client, token):
+    return client.get("/api/status", headers={app.SESSION_HEADER: token}).get_json()["scanned_faces"]
+
+
+def test_read_only_requests_do_not_write(client, store):
+    token = new_session(client)
+    del store.writes[:]
+    assert scanned(client, token) == []
+    client.get("/api/get-solution", headers={app.SESSION_HEADER: token})
+    assert store.writes == []
+
+
+def test_overlapping_frame_keeps_a_saved_face(client, store):
+    token = new_session(client)
+    # a streamed frame loads the session before /api/save-face and saves after it
+    _, frame_solver = app.load_session(token)
+    client.post("/api/save-face", json=GREEN, headers={app.SESSION_HEADER: token})
+    frame_solver.stabilizer.push(np.zeros(9, dtype=int))
+    app.save_session_state(token, frame_solver)
+    assert scanned(client, token) == ["Green"]
+    assert app.load_session(token)[1].stabilizer.filled == 1
+
+
+def test_unchanged_stale_copy_is_not_written(client, store):
+    token = new_session(client)
+    _, stale = app.load_session(token)
+    client.post("/api/save-face", json=GREEN, headers={app.SESSION_HEADER: token})
+    del store.writes[:]
+    app.save_session_state(token, stale)
+    assert store.writes == []
+    assert scanned(client, token) == ["Green"]
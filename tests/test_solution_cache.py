@@ -0,0 +1,74 @@
+import pytest
+
+from cube_state import ORIENTATIONS, CubeState
+from solution_cache import SolutionCache, canonicalize
+
+SCRAMBLE = "F2 D' L B2 U R2 F' D2 R U' B L2"
+
+
+class CountingSolver:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, cube_string):
+        import kociemba
+        self.calls.append(cube_string)
+        return kociemba.solve(cube_string)
+
+
+def rotated(cube_string, orientation):
+    """The same cube held in another of its 24 orientations"""
+    return CubeState(CubeState.from_string(cube_string).facelets[ORIENTATIONS[orientation]]).to_string()
+
+
+@pytest.mark.parametrize("orientation", [1, 5, 13, 23])
+def test_rotated_cube_hits_the_canonical_entry(orientation):
+    cube = CubeState().apply(SCRAMBLE).to_string()
+    cache = SolutionCache()
+    solver = CountingSolver()
+    cache.solve(cube, solver=solver)
+    turned = rotated(cube, orientation)
+    assert turned != cube
+    assert canonicalize(turned)[0] == canonicalize(cube)[0]
+    solution = cache.solve(turned, solver=solver)
+    assert len(solver.calls) == 1
+    assert cache.hits == 1
+    assert CubeState.from_string(turned).apply(solution.split()).is_solved()
+
+
+def test_put_then_get_from_another_orientation():
+    cube = CubeState().apply(SCRAMBLE).to_string()
+    cache = SolutionCache()
+    cache.put(cube, CountingSolver()(cube))
+    turned = rotated(cube, 7)
+    solution = cache.get(turned)
+    assert solution is not None
+    assert CubeState.from_string(turned).apply(solution.split()).is_solved()
+
+
+
+def lookup_in_child(cache, cube, results):
+    # only the SQLite file can answer once the in-memory entries are gone
+    cache.clear()
+    results.put((cache.get(cube), cache._db_pid))
+
+
+def test_sqlite_connection_is_opened_per_process(tmp_path):
+    multiprocessing = pytest.importorskip("multiprocessing")
+    if "fork" not in multiprocessing.get_all_start_methods():
+        pytest.skip("needs fork")
+    cube = CubeState().apply(SCRAMBLE).to_string()
+    cache = SolutionCache(path=str(tmp_path / "solutions.db"))
+    assert cache._db is None
+    solution = CountingSolver()(cube)
+    cache.put(cube, solution)
+    parent_db = cache._db
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    child = context.Process(target=lookup_in_child, args=(cache, cube, results))
+    child.start()
+    found, child_pid = results.get(timeout=30)
+    child.join()
+    assert CubeState.from_string(cube).apply(found.split()).is_solved()
+    assert child_pid == child.pid
+    assert cache._db is parent_db
@@ -0,0 +1,57 @@
+import os
+import signal
+import time
+
+import pytest
+
+from cube_state import CubeState
+from solver_pool import SolverPool
+
+
+@pytest.fixture
+def pool():
+    pool = SolverPool(workers=1, timeout=20)
+    yield pool
+    pool.shutdown()
+
+
+def wait_for(pool, job_id, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = pool.status(job_id)
+        if job["state"] not in ("queued", "running"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job still {job['state']} after {timeout}s")
+
+
+def solves(cube_string, job):
+    return job["state"] == "done" and CubeState.from_string(cube_string).apply(job["solution"].split()).is_solved()
+
+
+def test_idle_worker_killed_is_replaced(pool):
+    worker = pool.workers[0]
+    os.kill(worker.process.pid, signal.SIGKILL)
+    worker.process.join()
+    cube = CubeState().apply("L2 D' F R2 U B' D2 R'").to_string()
+    job = wait_for(pool, pool.submit(cube))
+    assert solves(cube, job)
+    assert pool.dispatcher.is_alive()
+    assert pool.workers[0] is not worker
+
+
+def test_dispatcher_survives_errors(pool, monkeypatch, capsys):
+    dispatch = pool._dispatch
+    failures = []
+
+    def failing_once():
+        if not failures:
+            failures.append(1)
+            raise RuntimeError("dispatch failed")
+        dispatch()
+
+    monkeypatch.setattr(pool, "_dispatch", failing_once)
+    cube = CubeState().apply("B U' R2 F' L D2 U R").to_string()
+    job = wait_for(pool, pool.submit(cube))
+    assert failures and solves(cube, job)
+    assert "dispatch failed" in capsys.readouterr().err
@@ -0,0 +1,35 @@
+import pytest
+
+import two_phase
+from cube_state import CubeState
+
+SCRAMBLES = [
+    "R U R' U'",
+    "F2 D' L B2 U R2 F' D2",
+    "R U2 F' L D2 B R' U F2 D L' B2 U' R2 F D' L2 B' U2 R",
+    "D B2 L' F U' R2 B D2 F' L2 U R' D' B L2 F2 R U2 L' D2",
+]
+
+
+@pytest.mark.parametrize("scramble", SCRAMBLES)
+def test_solution_solves_the_scramble(scramble):
+    cube = CubeState().apply(scramble).to_string()
+    solution = two_phase.solve(cube)
+    assert CubeState.from_string(cube).apply(solution.split()).is_solved()
+
+
+@pytest.mark.parametrize("scramble", SCRAMBLES[2:])
+def test_max_depth_bounds_the_length(scramble):
+    cube = CubeState().apply(scramble).to_string()
+    solution = two_phase.solve(cube, max_depth=22).split()
+    assert len(solution) <= 22
+    assert CubeState.from_string(cube).apply(solution).is_solved()
+
+
+def test_short_scramble_is_undone_optimally():
+    cube = CubeState().apply("R U F").to_string()
+    assert two_phase.solve(cube, optimal=True, time_budget=30) == "F' U' R'"
+
+
+def test_solved_cube_needs_no_moves():
+    assert two_phase.solve(CubeState().to_string()) == ""
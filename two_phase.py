@@ -0,0 +1,350 @@
+import itertools
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from cube_state import FACE_ORDER, MOVE_NAMES, MOVES
+
+# Cubies are numbered as in Kociemba's solver.  Corners: URF UFL ULB UBR DFR
+# DLF DBL DRB; edges: UR UF UL UB DR DF DL DB FR FL BL BR, the last four being
+# the UD slice.  Each row lists the facelets of one cubie position, starting
+# with its U/D facelet (or F/B for the slice edges).
+CORNER_FACELETS = np.array([[8, 9, 20], [6, 18, 38], [0, 36, 47], [2, 45, 11],
+                            [29, 26, 15], [27, 44, 24], [33, 53, 42], [35, 17, 51]])
+EDGE_FACELETS = np.array([[5, 10], [7, 19], [3, 37], [1, 46], [32, 16], [28, 25],
+                          [30, 43], [34, 52], [23, 12], [21, 41], [50, 39], [48, 14]])
+CORNER_COLORS = CORNER_FACELETS // 9
+EDGE_COLORS = EDGE_FACELETS // 9
+
+N_TWIST = 3 ** 7
+N_FLIP = 2 ** 11
+N_SLICE = math.comb(12, 4)
+N_PERM8 = math.factorial(8)
+N_PERM4 = math.factorial(4)
+
+TABLE_PATH = os.environ.get("CUBE_TWO_PHASE_TABLES",
+                            os.path.join(os.path.dirname(os.path.abspath(__file__)), "two_phase_tables.npz"))
+# phase 1 never needs more than 12 moves and phase 2 never more than 18
+MAX_LENGTH = 30
+# nodes expanded per vectorised step; bounds the memory used by the search
+CHUNK = 4096
+
+# phase 2 keeps the cube in <U, D, R2, L2, F2, B2>
+PHASE2_MOVES = np.array([MOVE_NAMES.index(m) for m in
+                         ("U", "U2", "U'", "D", "D2", "D'", "R2", "L2", "F2", "B2")])
+_IN_PHASE2 = np.zeros(len(MOVE_NAMES) + 1, dtype=bool)
+_IN_PHASE2[PHASE2_MOVES] = True
+_BINOMIAL = np.array([[math.comb(n, k) for k in range(13)] for n in range(13)])
+
+
+class NoSolution(ValueError):
+    """Raised when no solution fits the depth limit or time budget"""
+
+
+def _follows():
+    """FOLLOWS[last, move]: whether `move` may follow `last` (row 18 = no previous move)"""
+    faces = np.array([FACE_ORDER.index(name[0]) for name in MOVE_NAMES])
+    follows = np.ones((len(MOVE_NAMES) + 1, len(MOVE_NAMES)), dtype=bool)
+    for last, face in enumerate(faces):
+        # never turn the same face twice, and only one order of two opposite faces
+        follows[last] = (faces != face) & ~((faces % 3 == face % 3) & (faces < face))
+    return follows
+
+
+FOLLOWS = _follows()
+
+
+def _cubie_move(name):
+    """Corner/edge permutation and orientation of a single move"""
+    faces = np.repeat(np.arange(6), 9)[MOVES[name]]
+    return _to_cubies(faces)
+
+
+def _to_cubies(faces):
+    """(cp, co, ep, eo) of a 54-entry array of face indices, or ValueError if no cube has them"""
+    cp, co = np.zeros(8, dtype=np.intp), np.zeros(8, dtype=np.intp)
+    ep, eo = np.zeros(12, dtype=np.intp), np.zeros(12, dtype=np.intp)
+    corners = {tuple(colors): j for j, colors in enumerate(CORNER_COLORS)}
+    edges = {tuple(np.roll(colors, -k)): (j, k) for j, colors in enumerate(EDGE_COLORS) for k in range(2)}
+    for i, facelets in enumerate(CORNER_FACELETS):
+        # orientation is how far the U/D sticker sits from the reference facelet
+        ori = next((k for k in range(3) if faces[facelets[k]] % 3 == 0), None)
+        cubie = corners.get(tuple(faces[np.roll(facelets, -ori)])) if ori is not None else None
+        if cubie is None:
+            raise ValueError(f"Corner {i} has an impossible colour combination")
+        cp[i], co[i] = cubie, ori
+    for i, facelets in enumerate(EDGE_FACELETS):
+        cubie = edges.get(tuple(faces[facelets]))
+        if cubie is None:
+            raise ValueError(f"Edge {i} has an impossible colour combination")
+        ep[i], eo[i] = cubie
+    return cp, co, ep, eo
+
+
+def _parity(perm):
+    return sum(a > b for i, a in enumerate(perm) for b in perm[i + 1:]) % 2
+
+
+def from_string(cube_string):
+    """Cubie representation of a Kociemba facelet string; ValueError for unsolvable states"""
+    if len(cube_string) != 54 or any(c not in FACE_ORDER for c in cube_string):
+        raise ValueError("Expected 54 facelets from URFDLB")
+    faces = np.array([FACE_ORDER.index(c) for c in cube_string])
+    if (faces[4::9] != np.arange(6)).any():
+        raise ValueError("Centres must read URFDLB")
+    cp, co, ep, eo = _to_cubies(faces)
+    if len(set(cp)) != 8 or len(set(ep)) != 12:
+        raise ValueError("Some cubie appears twice")
+    if co.sum() % 3 or eo.sum() % 2:
+        raise ValueError("Twisted corner or flipped edge")
+    if _parity(list(cp)) != _parity(list(ep)):
+        raise ValueError("Two cubies are swapped")
+    return cp, co, ep, eo
+
+
+# coordinates, vectorised over the first axis
+
+def twist_coord(co):
+    return co[:, :7] @ 3 ** np.arange(6, -1, -1)
+
+
+def flip_coord(eo):
+    return eo[:, :11] @ 2 ** np.arange(10, -1, -1)
+
+
+def slice_coord(occupied):
+    """Position of the four UD-slice edges, 0..494 with 0 = all in the slice"""
+    occupied = occupied.astype(np.intp)
+    # slice edges to the right of each position
+    after = np.cumsum(occupied[:, ::-1], axis=1)[:, ::-1] - occupied
+    return (occupied * _BINOMIAL[np.arange(11, -1, -1), after + 1]).sum(axis=1)
+
+
+def perm_coord(perm):
+    """Lexicographic rank of each row permutation"""
+    n = perm.shape[1]
+    smaller_after = np.triu(perm[:, None, :] < perm[:, :, None], 1).sum(axis=2)
+    return smaller_after @ np.array([math.factorial(n - 1 - i) for i in range(n)])
+
+
+def _all_twists():
+    digits = np.array(list(itertools.product(range(3), repeat=7)))
+    return np.column_stack([digits, -digits.sum(axis=1) % 3])
+
+
+def _all_flips():
+    digits = np.array(list(itertools.product(range(2), repeat=11)))
+    return np.column_stack([digits, digits.sum(axis=1) % 2])
+
+
+def _all_slices():
+    occupied = np.zeros((N_SLICE, 12), dtype=bool)
+    for row, positions in enumerate(itertools.combinations(range(12), 4)):
+        occupied[row, list(positions)] = True
+    return occupied[np.argsort(slice_coord(occupied))]
+
+
+def _prune_table(move_a, move_b):
+    """Breadth-first distance to (0, 0) over the product of two coordinates"""
+    size_b = move_b.shape[0]
+    dist = np.full(move_a.shape[0] * size_b, -1, dtype=np.int8)
+    dist[0] = 0
+    frontier = np.zeros(1, dtype=np.intp)
+    depth = 0
+    while frontier.size:
+        a, b = np.divmod(frontier, size_b)
+        reached = (move_a[a].astype(np.intp) * size_b + move_b[b]).ravel()
+        frontier = np.unique(reached[dist[reached] < 0])
+        depth += 1
+        dist[frontier] = depth
+    return dist
+
+
+def build_tables():
+    """Move and pruning tables for both phases (a few seconds)"""
+    cubie_moves = [_cubie_move(name) for name in MOVE_NAMES]
+    corner_perm = np.array([m[0] for m in cubie_moves])
+    corner_ori = np.array([m[1] for m in cubie_moves])
+    edge_perm = np.array([m[2] for m in cubie_moves])
+    edge_ori = np.array([m[3] for m in cubie_moves])
+
+    twists, flips, slices = _all_twists(), _all_flips(), _all_slices()
+    twist = np.column_stack([twist_coord((twists[:, corner_perm[m]] + corner_ori[m]) % 3) for m in range(18)])
+    flip = np.column_stack([flip_coord((flips[:, edge_perm[m]] + edge_ori[m]) % 2) for m in range(18)])
+    slice_ = np.column_stack([slice_coord(slices[:, edge_perm[m]]) for m in range(18)])
+
+    perms8 = np.array(list(itertools.permutations(range(8))))
+    perms4 = np.array(list(itertools.permutations(range(8, 12))))
+    edges8 = np.column_stack([perms8, np.tile(np.arange(8, 12), (N_PERM8, 1))])
+    edges4 = np.column_stack([np.tile(np.arange(8), (N_PERM4, 1)), perms4])
+    corner = np.column_stack([perm_coord(perms8[:, corner_perm[m]]) for m in PHASE2_MOVES])
+    edge = np.column_stack([perm_coord(edges8[:, edge_perm[m]][:, :8]) for m in PHASE2_MOVES])
+    slice_perm = np.column_stack([perm_coord(edges4[:, edge_perm[m]][:, 8:]) for m in PHASE2_MOVES])
+
+    twist, flip, slice_ = twist.astype(np.uint16), flip.astype(np.uint16), slice_.astype(np.uint16)
+    corner, edge, slice_perm = corner.astype(np.uint16), edge.astype(np.uint16), slice_perm.astype(np.uint16)
+    return {
+        "corner_perm": corner_perm, "corner_ori": corner_ori, "edge_perm": edge_perm, "edge_ori": edge_ori,
+        "twist": twist, "flip": flip, "slice": slice_,
+        "corner": corner, "edge": edge, "slice_perm": slice_perm,
+        "twist_slice": _prune_table(twist, slice_), "flip_slice": _prune_table(flip, slice_),
+        "corner_slice": _prune_table(corner, slice_perm), "edge_slice": _prune_table(edge, slice_perm),
+    }
+
+
+_tables_lock = threading.Lock()
+_tables = None
+
+
+def load_tables(filename=TABLE_PATH):
+    """Shared tables, read from `filename` or built and saved there on first use"""
+    global _tables
+    with _tables_lock:
+        if _tables is None:
+            if not os.path.exists(filename):
+                tables = build_tables()
+                tmp = f"{filename}.{os.getpid()}.tmp"
+                with open(tmp, 'wb') as f:
+                    np.savez(f, **tables)
+                os.replace(tmp, filename)
+            with np.load(filename) as f:
+                _tables = {name: f[name] for name in f.files}
+    return _tables
+
+
+class _OutOfTime(Exception):
+    pass
+
+
+class _Phase:
+    """IDA* over one phase, expanding CHUNK nodes at a time with table lookups"""
+
+    def __init__(self, moves, coord_moves, prunes, skip_last=None):
+        self.moves = moves
+        self.coord_moves = coord_moves
+        # (coordinate index a, coordinate index b, distance table over a * size_b + b)
+        self.prunes = [(a, b, coord_moves[b].shape[0], dist) for a, b, dist in prunes]
+        self.skip_last = skip_last
+
+    def heuristic(self, coords):
+        return np.max([dist[coords[a].astype(np.intp) * size + coords[b]]
+                       for a, b, size, dist in self.prunes], axis=0)
+
+    def goals(self, coords, last, paths, bound, deadline):
+        """Yield batches of paths of exactly `bound` moves that reach the phase goal
+
+        `paths` holds the moves already made, so `bound` counts them too.
+        """
+        stack = [(coords, last, paths)]
+        while stack:
+            if deadline is not None and time.monotonic() > deadline:
+                raise _OutOfTime
+            coords, last, paths = stack.pop()
+            depth = paths.shape[1]
+            if depth == bound:
+                # only nodes with heuristic 0, i.e. goal states, survive to here
+                if self.skip_last is not None:
+                    keep = ~self.skip_last[last]
+                    coords, last, paths = [c[keep] for c in coords], last[keep], paths[keep]
+                if len(last):
+                    yield coords, last, paths
+                continue
+            moved = [table[c] for table, c in zip(self.coord_moves, coords)]
+            keep = FOLLOWS[last][:, self.moves] & (self.heuristic(moved) <= bound - depth - 1)
+            rows, cols = np.nonzero(keep)
+            coords = [c[rows, cols] for c in moved]
+            last = self.moves[cols]
+            paths = np.column_stack([paths[rows], last]).astype(np.uint8)
+            for start in range(len(rows) - CHUNK, -CHUNK, -CHUNK):
+                part = slice(max(start, 0), start + CHUNK)
+                stack.append(([c[part] for c in coords], last[part], paths[part]))
+
+
+def _phases(tables):
+    phase1 = _Phase(np.arange(18), [tables["twist"], tables["flip"], tables["slice"]],
+                    [(0, 2, tables["twist_slice"]), (1, 2, tables["flip_slice"])],
+                    # a phase 1 path ending in a phase 2 move was already found one move shorter
+                    skip_last=_IN_PHASE2)
+    phase2 = _Phase(PHASE2_MOVES, [tables["corner"], tables["edge"], tables["slice_perm"]],
+                    [(0, 2, tables["corner_slice"]), (1, 2, tables["edge_slice"])])
+    return phase1, phase2
+
+
+def _phase2_start(tables, cubies, paths):
+    """Phase 2 coordinates after applying each row of `paths` to the cube"""
+    cp = np.tile(cubies[0], (len(paths), 1))
+    ep = np.tile(cubies[2], (len(paths), 1))
+    for step in paths.T:
+        cp = np.take_along_axis(cp, tables["corner_perm"][step], axis=1)
+        ep = np.take_along_axis(ep, tables["edge_perm"][step], axis=1)
+    return [perm_coord(cp), perm_coord(ep[:, :8]), perm_coord(ep[:, 8:] - 8)]
+
+
+def _finish(tables, phase2, cubies, last, paths, limit, deadline):
+    """Shortest completion of any phase 1 path within `limit` total moves, or None"""
+    coords = _phase2_start(tables, cubies, paths)
+    estimate = phase2.heuristic(coords)
+    for bound in range(paths.shape[1] + int(estimate.min()), limit + 1):
+        ready = estimate <= bound - paths.shape[1]
+        for _, _, found in phase2.goals([c[ready] for c in coords], last[ready], paths[ready], bound, deadline):
+            return found[0]
+    return None
+
+
+def solve(cube_string, max_depth=None, time_budget=None, optimal=False):
+    """Two-phase solve returning moves in the same format as kociemba.solve
+
+    With no options this returns the first solution found.  `max_depth`
+    caps the length and stops the search at the first solution that fits.
+    `time_budget` (seconds) keeps shortening the solution until it runs out
+    and then returns the best one found, raising NoSolution if there is none
+    yet.  `optimal` keeps going until no shorter two-phase solution exists,
+    which can take minutes, so pair it with `time_budget` for batch jobs.
+    """
+    deadline = None if time_budget is None else time.monotonic() + time_budget
+    tables = load_tables()
+    cubies = from_string(cube_string)
+    phase1, phase2 = _phases(tables)
+    coords = [twist_coord(cubies[1][None]), flip_coord(cubies[3][None]), slice_coord(cubies[2][None] >= 8)]
+    limit = MAX_LENGTH if max_depth is None else max_depth
+    keep_going = optimal or (time_budget is not None and max_depth is None)
+    best = None
+    try:
+        for bound in range(int(phase1.heuristic(coords)[0]), limit + 1):
+            if best is not None and bound >= len(best):
+                break
+            start = (coords, np.full(1, len(MOVE_NAMES)), np.zeros((1, 0), dtype=np.uint8))
+            for _, last, paths in phase1.goals(*start, bound, deadline):
+                found = _finish(tables, phase2, cubies, last, paths,
+                                limit if best is None else len(best) - 1, deadline)
+                if found is not None:
+                    best = found
+                    if not keep_going:
+                        return _format(best)
+                    if bound >= len(best):
+                        break
+    except _OutOfTime:
+        pass
+    if best is None:
+        raise NoSolution(f"No solution within {limit} moves" if deadline is None or time.monotonic() < deadline
+                         else f"No solution within {time_budget:g}s")
+    return _format(best)
+
+
+def _format(path):
+    return " ".join(MOVE_NAMES[m] for m in path)
+
+
+if __name__ == "__main__":
+    import sys
+
+    start = time.perf_counter()
+    load_tables()
+    print(f"tables: {time.perf_counter() - start:.1f}s")
+    for line in sys.argv[1:] or ["DRLUUBFBRBLURRLRUBLRDDFDLFUFUFFDBRDUBRUFLLFDDBFLUBLRBD"]:
+        start = time.perf_counter()
+        solution = solve(line)
+        print(f"{solution} ({len(solution.split())} moves, {time.perf_counter() - start:.2f}s)")
@@ -0,0 +1,9 @@
+"""Forkserver preload for solver_pool with CUBE_SOLVER=two_phase.
+
+Importing this reads the two-phase tables once in the fork server, so every
+worker forked from it, including replacements for timed out or cancelled
+ones, starts warm and shares those pages copy-on-write.
+"""
+from two_phase import load_tables
+
+load_tables()